@@ -0,0 +1,49 @@
+import os
+import sys
+import tempfile
+import time
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from bench_quantization import make_embeddings, recall_at_k
+from utils.comparison.ann_index import IVFIndex
+from utils.comparison.cosine_similarity import cosine_similarity_topk
+
+
+def run(n_corpus: int = 50000, n_queries: int = 500, dimension: int = 256, k: int = 10, n_lists: int = 256) -> list[dict]:
+    corpus, queries = make_embeddings(n_corpus, dimension, n_queries)
+
+    start = time.perf_counter()
+    exact, _ = cosine_similarity_topk(queries, corpus, k=k)
+    results = [{"method": "exact (cosine_similarity_topk)", "seconds": time.perf_counter() - start, "recall": 1.0}]
+
+    start = time.perf_counter()
+    index = IVFIndex(n_lists=n_lists).train(corpus).add(corpus)
+    build_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        index.save(directory)
+        index = IVFIndex.load(directory, mmap=True)
+        for n_probe in (1, 4, 8, 16, 32):
+            start = time.perf_counter()
+            found, _ = index.search(queries, k=k, n_probe=n_probe)
+            elapsed = time.perf_counter() - start
+            results.append({
+                "method": f"IVF n_probe={n_probe}",
+                "seconds": elapsed,
+                "recall": recall_at_k(found, exact),
+                "build_seconds": build_time,
+            })
+        # 読み込んだインデックスを閉じてから一時ディレクトリを消す
+        del index
+    return results
+
+
+def main():
+    for result in run():
+        print(f"{result['method']:>32}: recall@10={result['recall']:.3f} time={result['seconds']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
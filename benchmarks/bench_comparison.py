@@ -0,0 +1,114 @@
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from openai_api.embedding import Embedding
+from utils.comparison.cosine_similarity import cosine_similarity, flatten_self_sim_df
+from utils.comparison.entropy import get_entropy_all
+from utils.comparison.js_divergence import get_js_divergence_at_once
+
+
+def measure(func, repeat: int = 3) -> dict:
+    """funcをrepeat回実行し, 最短・平均の実行時間と, tracemallocで測ったピークメモリを返す.
+
+    NumPyの配列の確保はtracemallocに記録されるため, 作業用配列を含めたピークを測れる.
+    ピークメモリは計測のオーバーヘッドを避けるため, 時間とは別に1回だけ測る.
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"seconds": min(times), "mean_seconds": sum(times) / len(times), "peak_bytes": peak}
+
+
+def _probabilities(rng, n: int, d: int, sparsity: float = 0.5) -> np.ndarray:
+    matrix = rng.random((n, d))
+    matrix[matrix < sparsity] = 0
+    matrix[:, 0] += 1e-3
+    return matrix / matrix.sum(axis=1, keepdims=True)
+
+
+def run(quick: bool = False, repeat: int = 3, seed: int = 0) -> list[dict]:
+    """比較用の関数を代表的な形と型で計測する.
+
+    Args:
+        quick (bool): Trueの場合は小さい形だけを使う（動作確認用）
+        repeat (int): 時間を測る回数
+        seed (int): 入力を作る乱数のシード
+    Returns:
+        list[dict]: {"suite", "name", "params", "seconds", "mean_seconds", "peak_bytes"} のリスト
+    """
+    rng = np.random.default_rng(seed)
+    results = []
+
+    def record(name, params, func):
+        results.append({"suite": "comparison", "name": name, "params": params, **measure(func, repeat)})
+
+    # コサイン類似度: (n, d) x (m, d). 埋め込みの次元数と精度ごと
+    cosine_shapes = [(500, 256, 500)] if quick else [(1000, 256, 1000), (2000, 1536, 2000), (5000, 256, 5000)]
+    for n, d, m in cosine_shapes:
+        for dtype in (np.float32, np.float64):
+            a = rng.standard_normal((n, d)).astype(dtype)
+            b = rng.standard_normal((m, d)).astype(dtype)
+            params = {"n": n, "m": m, "d": d, "dtype": np.dtype(dtype).name}
+            record("cosine_similarity", params, lambda: cosine_similarity(a, b))
+
+    # 自己類似度の上三角のフラット化
+    for n in ([300] if quick else [1000, 3000]):
+        similarity = cosine_similarity(*(2 * [rng.standard_normal((n, 64)).astype(np.float32)]))
+        record("flatten_self_sim_df", {"n": n}, lambda: flatten_self_sim_df(similarity))
+
+    # JSダイバージェンス: (n, m, d) のテンソルを作るため, 形はメモリに収まる範囲にする
+    js_shapes = [(50, 50, 50)] if quick else [(200, 200, 100), (500, 500, 50)]
+    for n, m, d in js_shapes:
+        p = _probabilities(rng, n, d)
+        q = _probabilities(rng, m, d)
+        record("get_js_divergence_at_once", {"n": n, "m": m, "d": d}, lambda: get_js_divergence_at_once(p, q))
+
+    # エントロピー: 密な度数行列と, 長さの異なるリスト
+    entropy_shapes = [(1000, 20)] if quick else [(100_000, 50), (1_000_000, 10)]
+    for n, d in entropy_shapes:
+        counts = rng.poisson(1.0, (n, d))
+        record("get_entropy_all", {"n": n, "d": d, "input": "dense"}, lambda: get_entropy_all(counts))
+    n_ragged = 1000 if quick else 100_000
+    lengths = rng.geometric(0.1, n_ragged)
+    ragged = [list(rng.integers(1, 10, length)) for length in lengths]
+    record("get_entropy_all", {"n": n_ragged, "mean_length": float(lengths.mean()), "input": "ragged"}, lambda: get_entropy_all(ragged))
+
+    # 次元削減: 配列の入力とリストの入力
+    embedding = Embedding(api_key="benchmark")
+    for n in ([1000] if quick else [10_000, 50_000]):
+        for dtype in (np.float32, np.float64):
+            embeddings = rng.standard_normal((n, 1536)).astype(dtype)
+            params = {"n": n, "d": 1536, "dimension": 256, "dtype": np.dtype(dtype).name, "input": "ndarray"}
+            record("dimension_reduction", params, lambda: embedding.dimension_reduction(embeddings, 256))
+    n_list = 200 if quick else 5000
+    embeddings_list = rng.standard_normal((n_list, 1536)).tolist()
+    params = {"n": n_list, "d": 1536, "dimension": 256, "input": "list"}
+    record("dimension_reduction", params, lambda: embedding.dimension_reduction(embeddings_list, 256))
+    return results
+
+
+def main():
+    for result in run():
+        print(
+            f"{result['name']:>26} {result['params']}: "
+            f"time={result['seconds']:.4f}s peak={result['peak_bytes'] / 1e6:.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import contextlib
+import io
+import os
+import sys
+import time
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from fake_clients import FakeOpenAI, FakeTwitterSession
+from openai_api.embedding import Embedding
+from twitter_api.rate_limit import RateLimitScheduler
+from twitter_api.twitter_api import TwitterAPI
+from utils.instrumentation import MetricsCollector
+
+
+def _timed(func):
+    """funcを実行し, 結果と経過秒数を返す. リトライの[WARN]などの出力は捨てる."""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func()
+    return result, time.perf_counter() - start
+
+
+def run_embedding(n_texts: int, latency: float, rate_limit_probability: float, max_concurrency: int = 8) -> list[dict]:
+    """偽のクライアントに対してembed（逐次）とembed_concurrent（並行）のスループットを測る."""
+    texts = [f"benchmark text {i}" for i in range(n_texts)]
+    # 1リクエストを小さくして, 件数が少なくてもリクエスト数が十分になるようにする
+    options = dict(sleep_time=0.01, as_array=True, max_batch_tokens=2000)
+    results = []
+    cases = {
+        "embed": lambda embedding: embedding.embed(texts, **options),
+        "embed_concurrent": lambda embedding: embedding.embed_concurrent(
+            texts, max_concurrency=max_concurrency, **options
+        ),
+    }
+    for name, func in cases.items():
+        client = FakeOpenAI(latency=latency, rate_limit_probability=rate_limit_probability)
+        metrics = MetricsCollector()
+        embedding = Embedding(api_key="benchmark", hooks=metrics)
+        embedding.client = client
+        embedding.async_client = client.async_view()
+        _, elapsed = _timed(lambda: func(embedding))
+        results.append({
+            "suite": "pipelines",
+            "name": f"Embedding.{name}",
+            "params": {
+                "n_texts": n_texts, "latency": latency, "rate_limit_probability": rate_limit_probability,
+                **({"max_concurrency": max_concurrency} if name == "embed_concurrent" else {}),
+            },
+            "seconds": elapsed,
+            "items_per_second": n_texts / elapsed,
+            "requests": client.requests,
+            "rate_limited": client.rate_limited,
+            "metrics": metrics.snapshot(),
+        })
+    return results
+
+
+def run_twitter(n_queries: int, pages_per_query: int, latency: float, rate_limit_probability: float, max_workers: int = 8) -> list[dict]:
+    """偽のセッションに対してページネーション（逐次）と複数IDの並行取得のスループットを測る."""
+    results = []
+    cases = {
+        "iter_tweets_from_query": lambda api: [
+            page for i in range(n_queries) for page in api.iter_tweets_from_query(f"query {i}")
+        ],
+        "iter_bulk_retweet_users": lambda api: [
+            page
+            for _, pages, _ in api.iter_bulk_retweet_users((str(i) for i in range(n_queries)), max_workers=max_workers)
+            for page in pages or []
+        ],
+    }
+    for name, func in cases.items():
+        session = FakeTwitterSession(pages_per_query, latency=latency, rate_limit_probability=rate_limit_probability)
+        # ローカルの計測なので全期間検索の1秒間隔の制限はかけない
+        metrics = MetricsCollector()
+        api = TwitterAPI(
+            "benchmark", "benchmark", rate_limiter=RateLimitScheduler(min_intervals={}, margin=0.0), hooks=metrics
+        )
+        api.session = session
+        pages, elapsed = _timed(lambda: func(api))
+        results.append({
+            "suite": "pipelines",
+            "name": f"TwitterAPI.{name}",
+            "params": {
+                "n_queries": n_queries, "pages_per_query": pages_per_query, "latency": latency,
+                "rate_limit_probability": rate_limit_probability,
+                **({"max_workers": max_workers} if name == "iter_bulk_retweet_users" else {}),
+            },
+            "seconds": elapsed,
+            "pages": len(pages),
+            "pages_per_second": len(pages) / elapsed,
+            "requests": session.requests,
+            "rate_limited": session.rate_limited,
+            "rate_limit_wait_seconds": api.rate_limiter.total_wait,
+            "metrics": metrics.snapshot(),
+        })
+    return results
+
+
+def run(quick: bool = False) -> list[dict]:
+    """埋め込みとTwitterの取得を, 429なしと429ありの条件で計測する.
+
+    Args:
+        quick (bool): Trueの場合は件数を減らす（動作確認用）
+    Returns:
+        list[dict]: {"suite", "name", "params", "seconds", ...} のリスト
+    """
+    results = []
+    n_texts = 2000 if quick else 20000
+    n_queries, pages_per_query = (4, 5) if quick else (16, 20)
+    for rate_limit_probability in (0.0, 0.1):
+        results.extend(run_embedding(n_texts, latency=0.05, rate_limit_probability=rate_limit_probability))
+        results.extend(run_twitter(n_queries, pages_per_query, latency=0.02, rate_limit_probability=rate_limit_probability))
+    return results
+
+
+def main():
+    for result in run():
+        print(f"{result['name']:>34} {result['params']}: time={result['seconds']:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from openai_api.quantization import quantize_binary, quantize_int8, quantized_top_k
+from utils.comparison.cosine_similarity import cosine_similarity
+
+
+def make_embeddings(n: int, dimension: int, n_queries: int = 0, n_clusters: int = 50, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """クラスタ構造を持つ正規化済みの疑似埋め込みと, 同じクラスタから作ったクエリを作る."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dimension))
+    embeddings = centers[rng.integers(n_clusters, size=n + n_queries)] + 0.7 * rng.standard_normal((n + n_queries, dimension))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings = embeddings.astype(np.float32)
+    return embeddings[:n], embeddings[n:]
+
+
+def recall_at_k(found: np.ndarray, exact: np.ndarray) -> float:
+    k = exact.shape[1]
+    return float(np.mean([len(set(f) & set(e)) / k for f, e in zip(found, exact)]))
+
+
+def run(n_corpus: int = 20000, n_queries: int = 200, dimension: int = 256, k: int = 10) -> list[dict]:
+    corpus, queries = make_embeddings(n_corpus, dimension, n_queries)
+
+    start = time.perf_counter()
+    exact_scores = cosine_similarity(queries, corpus).values
+    exact_time = time.perf_counter() - start
+    exact = np.argsort(-exact_scores, axis=1)[:, :k]
+
+    codes, scales = quantize_int8(corpus)
+    bits = quantize_binary(corpus)
+    cases = {
+        "int8": dict(codes=codes, scales=scales),
+        "int8+rerank": dict(codes=codes, scales=scales, rerank_embeddings=corpus),
+        "binary": dict(codes=bits),
+        "binary+rerank": dict(codes=bits, rerank_embeddings=corpus, n_candidates=k * 10),
+    }
+    results = [{"method": "float (cosine_similarity)", "bytes": corpus.nbytes, "seconds": exact_time, "recall": 1.0}]
+    for name, kwargs in cases.items():
+        start = time.perf_counter()
+        indices, _ = quantized_top_k(queries, k=k, **kwargs)
+        elapsed = time.perf_counter() - start
+        nbytes = kwargs["codes"].nbytes + (kwargs["scales"].nbytes if "scales" in kwargs else 0)
+        results.append({"method": name, "bytes": nbytes, "seconds": elapsed, "recall": recall_at_k(indices, exact)})
+    return results
+
+
+def main():
+    for result in run():
+        print(
+            f"{result['method']:>26}: recall@10={result['recall']:.3f} "
+            f"time={result['seconds']:.3f}s memory={result['bytes'] / 1e6:.1f}MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import json
+import random
+import threading
+import time
+
+# 埋め込みの偽クライアントはテストと共有するためパッケージ側に置いている
+from openai_api.testing import FakeAPIError, FakeOpenAI
+
+
+class FakeTwitterResponse:
+    def __init__(self, status_code: int, payload, headers: dict):
+        self.status_code = status_code
+        self._payload = payload
+        self.headers = headers
+        self.text = json.dumps(payload) if isinstance(payload, (dict, list)) else str(payload)
+
+    def json(self):
+        return self._payload
+
+
+class FakeTwitterSession:
+    """TwitterAPI.session の代わりに使う, ページネーションを再現するセッション.
+
+    URLとパラメータごとにpages_per_queryページを返し, rate_limit_probabilityの確率で
+    x-rate-limit-reset をreset_after秒後にした429を返す.
+    成功したレスポンスのヘッダは, window秒ごとにlimit回のレート制限を表す.
+    """
+
+    def __init__(
+        self,
+        pages_per_query: int = 20,
+        results_per_page: int = 100,
+        latency: float = 0.02,
+        rate_limit_probability: float = 0.0,
+        reset_after: float = 0.05,
+        limit: int = 100_000,
+        window: float = 1.0,
+        seed: int = 0,
+    ):
+        """
+        Args:
+            pages_per_query (int): 1つのクエリ(またはtweet_id)あたりのページ数
+            results_per_page (int): 1ページあたりの件数
+            latency (float): 1リクエストあたりの待ち時間(秒)
+            rate_limit_probability (float): 429を返す確率
+            reset_after (float): 429のリセットまでの秒数
+            limit (int): x-rate-limit-limit と x-rate-limit-remaining に入れる回数
+            window (float): x-rate-limit-reset までの秒数. RateLimitSchedulerは残り回数をこの時間に均等に割り振る
+            seed (int): 429を起こす乱数のシード
+        """
+        self.pages_per_query = pages_per_query
+        self.results_per_page = results_per_page
+        self.latency = latency
+        self.rate_limit_probability = rate_limit_probability
+        self.reset_after = reset_after
+        self.limit = limit
+        self.window = window
+        self.requests = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def get(self, url, auth=None, params=None):
+        params = params or {}
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            rate_limited = self._random.random() < self.rate_limit_probability
+            if rate_limited:
+                self.rate_limited += 1
+        now = time.time()
+        if rate_limited:
+            return FakeTwitterResponse(429, "Too Many Requests", {
+                "x-rate-limit-limit": str(self.limit), "x-rate-limit-remaining": "0",
+                "x-rate-limit-reset": str(now + self.reset_after),
+            })
+        page = int(params.get("next_token") or params.get("pagination_token") or 0)
+        data = [
+            {"id": f"{page}-{i}", "text": "benchmark", "created_at": "2024-01-01T00:00:00.000Z"}
+            for i in range(self.results_per_page)
+        ]
+        meta = {"result_count": len(data)}
+        if page + 1 < self.pages_per_query:
+            meta["next_token"] = str(page + 1)
+        return FakeTwitterResponse(200, {"data": data, "meta": meta}, {
+            "x-rate-limit-limit": str(self.limit), "x-rate-limit-remaining": str(self.limit - 1),
+            "x-rate-limit-reset": str(now + self.window),
+        })
+
+    def close(self):
+        pass
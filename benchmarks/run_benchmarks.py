@@ -0,0 +1,84 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(__file__))
+
+import bench_comparison
+import bench_pipelines
+
+SUITES = {"comparison": bench_comparison.run, "pipelines": bench_pipelines.run}
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _key(result: dict) -> str:
+    return json.dumps([result["suite"], result["name"], result["params"]], sort_keys=True)
+
+
+def compare(baseline: dict, current: dict) -> list[dict]:
+    """2回の実行結果を同じ (suite, name, params) どうしで比べ, 時間とピークメモリの比を返す."""
+    previous = {_key(result): result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        before = previous.get(_key(result))
+        if before is None:
+            continue
+        row = {"name": result["name"], "params": result["params"], "time_ratio": result["seconds"] / before["seconds"]}
+        if "peak_bytes" in result and before.get("peak_bytes"):
+            row["memory_ratio"] = result["peak_bytes"] / before["peak_bytes"]
+        rows.append(row)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run benchmarks and write the results as JSON.")
+    parser.add_argument("--suite", choices=list(SUITES), action="append", help="suites to run (default: all)")
+    parser.add_argument("--quick", action="store_true", help="use small inputs for a smoke test")
+    parser.add_argument("--output", help="path of the JSON file (default: stdout)")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare against")
+    args = parser.parse_args()
+
+    results = []
+    for suite in args.suite or list(SUITES):
+        results.extend(SUITES[suite](quick=args.quick))
+    report = {
+        "metadata": {
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "quick": args.quick,
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(json.load(f), report)
+
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1 +1,11 @@
-from .embedding import Embedding
\ No newline at end of file
+from .embedding import Embedding
+from .embedding_cache import EmbeddingCache
+from .quantization import (
+    binary_similarity,
+    dequantize_int8,
+    hamming_distance,
+    int8_similarity,
+    quantize_binary,
+    quantize_int8,
+    quantized_top_k,
+)
\ No newline at end of file
@@ -1,42 +1,552 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 import numpy as np
+import asyncio
+import base64
+import email.utils
+import itertools
+import json
+import os
+import random
+import threading
 import time
+from typing import Callable, Iterable, Iterator
+
+from .embedding_cache import EmbeddingCache
+from .rate_limiter import AsyncTokenBucket
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# 1リクエストあたりの入力件数の上限
+MAX_BATCH_SIZE = 2048
+# 1リクエストあたりのトークン数の既定値. APIの上限(300,000)に見積もり誤差の余裕を持たせている
+MAX_BATCH_TOKENS = 250_000
+# モデルごとの埋め込みの次元数. すべてのテキストをスキップした場合に, NaNの行の幅として使う
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+_encoding = None
+
+
+def _estimate_tokens(text: str) -> int:
+    """テキストのトークン数を見積もる. tiktokenがない場合はUTF-8のバイト数から多めに概算する."""
+    global _encoding
+    if tiktoken is None:
+        # 英語はおよそ4バイト, 日本語はおよそ3バイトで1トークンになる
+        return len(text.encode("utf-8")) // 3 + 1
+    if _encoding is None:
+        # text-embedding-3系 / ada-002 はいずれも cl100k_base を使う
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _split_batches(texts: list[str], max_batch_tokens: int, max_batch_size: int = MAX_BATCH_SIZE):
+    """件数の上限とトークン数の上限の両方を満たすようにテキストを分割する.
+
+    Yields:
+        tuple[list[str], int]: (バッチ, 見積もったトークン数)
+    """
+    batch = []
+    n_tokens = 0
+    for text in texts:
+        n = _estimate_tokens(text)
+        if batch and (len(batch) >= max_batch_size or n_tokens + n > max_batch_tokens):
+            yield batch, n_tokens
+            batch, n_tokens = [], 0
+        batch.append(text)
+        n_tokens += n
+    if batch:
+        yield batch, n_tokens
+
+
+def _is_retryable(e: Exception) -> bool:
+    """待てば成功する可能性がある例外かどうか. ステータスコードがない例外(接続エラーなど)はリトライする."""
+    status = getattr(e, "status_code", None)
+    return status is None or status in (408, 409, 429) or status >= 500
+
+
+def _is_input_error(e: Exception) -> bool:
+    """入力テキストが原因の失敗かどうか. 分割して原因のテキストを特定するのはこの場合だけで,
+    認証エラー(401, 403)や存在しないモデル(404)などは分割しても解決しないのでそのまま送出する."""
+    return getattr(e, "status_code", None) in (400, 413, 422)
+
+
+def _retry_after(e: Exception) -> float | None:
+    """レスポンスヘッダの retry-after-ms / Retry-After から待機秒数を求める."""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if value is None:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP-date形式
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _backoff_delay(e: Exception, attempt: int, sleep_time: float) -> float:
+    """Retry-Afterがあればそれに従い, なければsleep_timeを基準にジッター付きの指数バックオフで待機秒数を求める."""
+    retry_after = _retry_after(e)
+    if retry_after is not None:
+        return retry_after
+    delay = min(max(60.0, sleep_time), sleep_time * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _assemble(pieces: list[tuple[int, object]], as_array: bool, model: str) -> list[list[float]] | np.ndarray:
+    """(件数, レスポンス) の列を入力順の埋め込みにまとめる.
+
+    スキップした要素(レスポンスがNone)はリストの場合None, 配列の場合NaNの行になる.
+    配列ですべてスキップした場合は, MODEL_DIMENSIONSの次元数の行にする.
+    """
+    if not as_array:
+        embeddings = []
+        for count, res in pieces:
+            embeddings.extend([data.embedding for data in res.data] if res is not None else [None] * count)
+        return embeddings
+    arrays = [_response_to_array(res) if res is not None else None for _, res in pieces]
+    if all(array is not None for array in arrays):
+        return _concat_arrays(arrays)
+    dim = next((array.shape[1] for array in arrays if array is not None), None)
+    if dim is None:
+        dim = MODEL_DIMENSIONS.get(model, 0) if pieces else 0
+        if dim == 0 and pieces:
+            raise ValueError(f"None of the texts could be embedded, and the dimension of {model!r} is unknown")
+    embeddings = np.full((sum(count for count, _ in pieces), dim), np.nan, dtype=np.float32)
+    i = 0
+    for (count, _), array in zip(pieces, arrays):
+        if array is not None:
+            embeddings[i:i + count] = array
+        i += count
+    return embeddings
+
+
+def _response_to_array(res) -> np.ndarray:
+    """レスポンスの埋め込みを (件数, 次元数) の連続したfloat32配列に変換する.
+
+    base64形式の場合はデコードしたバイト列をそのまま配列として扱い, floatのリストを経由しない.
+    """
+    if not res.data:
+        return np.empty((0, 0), dtype=np.float32)
+    if isinstance(res.data[0].embedding, str):
+        # bytearrayを使うことで, 呼び出し元がその場で書き換えられる書き込み可能な配列になる
+        raw = bytearray().join(base64.b64decode(data.embedding) for data in res.data)
+        return np.frombuffer(raw, dtype="<f4").reshape(len(res.data), -1)
+    return np.array([data.embedding for data in res.data], dtype=np.float32)
+
+
+def _concat_arrays(arrays: list[np.ndarray]) -> np.ndarray:
+    if not arrays:
+        return np.empty((0, 0), dtype=np.float32)
+    if len(arrays) == 1:
+        return arrays[0]
+    return np.concatenate(arrays)
+
 
 class Embedding:
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, cache: EmbeddingCache | None = None, hooks: Callable | None = None):
+        """
+        Args:
+            api_key (str): OpenAIのAPIキー
+            cache (EmbeddingCache | None): 埋め込みの永続キャッシュ. 指定した場合はヒットしたテキストをAPIに送らない
+            hooks (Callable | None): 計測用のフック. hooks(event, **fields) の形で, リクエストごとのレイテンシ・件数・バイト数,
+                リトライ, レート制限の待ち時間, キャッシュのヒット数を受け取る（utils.instrumentation.MetricsCollectorなど）.
+                Noneの場合は計測しない
+        """
         self.client = OpenAI(api_key=api_key)
+        self.async_client = AsyncOpenAI(api_key=api_key)
+        self.cache = cache
+        self.hooks = hooks
+        self._loop = None
+
+    def _emit_request(self, model: str, input: list[str], start: float, status):
+        self.hooks(
+            "request", component="openai", endpoint=model, latency=time.perf_counter() - start,
+            items=len(input), bytes=sum(len(text.encode("utf-8")) for text in input), status=status,
+        )
+
+    def _emit_retry(self, model: str, e: Exception, delay: float):
+        status = getattr(e, "status_code", None)
+        self.hooks("retry", component="openai", endpoint=model, delay=delay, status=status)
+        if status == 429:
+            self.hooks("rate_limit_wait", component="openai", endpoint=model, seconds=delay)
     
-    def _n_time_embed_trial(self, input: list[str], model: str = "text-embedding-3-small", n: int = 3, sleep_time: int = 10):
-        try: 
-            res = self.client.embeddings.create(input=input, model=model)
+    def _n_time_embed_trial(self, input: list[str], model: str = "text-embedding-3-small", n: int = 3, sleep_time: int = 10, encoding_format: str | None = None):
+        kwargs = {"encoding_format": encoding_format} if encoding_format else {}
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self.client.embeddings.create(input=input, model=model, **kwargs)
+                if self.hooks is not None:
+                    self._emit_request(model, input, start, 200)
+                return response
+            except Exception as e:
+                if self.hooks is not None:
+                    self._emit_request(model, input, start, getattr(e, "status_code", None))
+                # 入力が不正な場合などはリトライしても成功しないので, 呼び出し元で分割させる
+                if not _is_retryable(e):
+                    raise e
+                if attempt >= n:
+                    print(f"[WARN] Embedding failed after retries")
+                    raise e
+                delay = _backoff_delay(e, attempt, sleep_time)
+                print(f"[WARN] Embedding failed, retrying {n - attempt} more times in {delay:.1f}s: {e}")
+                if self.hooks is not None:
+                    self._emit_retry(model, e, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def _embed_chunk(self, batch: list[str], model: str, retry_num: int, sleep_time: int, encoding_format: str | None = None) -> list[tuple[int, object]]:
+        """バッチを埋め込む. 入力が原因の失敗(400, 413, 422)の場合は半分に分割して原因のテキストを特定し, スキップする.
+        それ以外の失敗はそのまま送出する.
+
+        Returns:
+            list[tuple[int, object]]: (件数, レスポンス) の列. スキップしたテキストのレスポンスはNone
+        """
+        try:
+            return [(len(batch), self._n_time_embed_trial(batch, model, retry_num, sleep_time, encoding_format))]
+        except Exception as e:
+            if not _is_input_error(e):
+                raise e
+            if len(batch) == 1:
+                print(f"[WARN] Skipping text that cannot be embedded ({batch[0][:50]!r}): {e}")
+                return [(1, None)]
+            mid = len(batch) // 2
+            return (
+                self._embed_chunk(batch[:mid], model, retry_num, sleep_time, encoding_format)
+                + self._embed_chunk(batch[mid:], model, retry_num, sleep_time, encoding_format)
+            )
+
+    async def _an_time_embed_trial(
+        self,
+        input: list[str],
+        model: str,
+        n: int,
+        sleep_time: int,
+        request_bucket: AsyncTokenBucket | None = None,
+        token_bucket: AsyncTokenBucket | None = None,
+        encoding_format: str | None = None,
+        n_tokens: int | None = None,
+    ):
+        kwargs = {"encoding_format": encoding_format} if encoding_format else {}
+        if token_bucket and n_tokens is None:
+            n_tokens = sum(_estimate_tokens(text) for text in input)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            if request_bucket:
+                await request_bucket.acquire()
+            if token_bucket:
+                await token_bucket.acquire(n_tokens)
+            if self.hooks is not None and (request_bucket or token_bucket):
+                self.hooks("rate_limit_wait", component="openai", endpoint=model, seconds=time.perf_counter() - start)
+            start = time.perf_counter()
+            try:
+                response = await self.async_client.embeddings.create(input=input, model=model, **kwargs)
+                if self.hooks is not None:
+                    self._emit_request(model, input, start, 200)
+                return response
+            except Exception as e:
+                if self.hooks is not None:
+                    self._emit_request(model, input, start, getattr(e, "status_code", None))
+                if getattr(e, "status_code", None) == 429:
+                    # 他の並行リクエストも含めて補充を待たせる
+                    for bucket in (request_bucket, token_bucket):
+                        if bucket:
+                            bucket.drain()
+                if not _is_retryable(e):
+                    raise e
+                if attempt >= n:
+                    print(f"[WARN] Embedding failed after retries")
+                    raise e
+                delay = _backoff_delay(e, attempt, sleep_time)
+                print(f"[WARN] Embedding failed, retrying {n - attempt} more times in {delay:.1f}s: {e}")
+                if self.hooks is not None:
+                    self._emit_retry(model, e, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    async def _aembed_chunk(
+        self,
+        batch: list[str],
+        model: str,
+        retry_num: int,
+        sleep_time: int,
+        request_bucket: AsyncTokenBucket | None = None,
+        token_bucket: AsyncTokenBucket | None = None,
+        encoding_format: str | None = None,
+        n_tokens: int | None = None,
+    ) -> list[tuple[int, object]]:
+        """_embed_chunkの非同期版."""
+        try:
+            res = await self._an_time_embed_trial(
+                batch, model, retry_num, sleep_time, request_bucket, token_bucket, encoding_format, n_tokens
+            )
+            return [(len(batch), res)]
         except Exception as e:
-            if n > 0:
-                print(f"[WARN] Embedding failed, retrying {n} more times: {e}")
-                time.sleep(sleep_time)
-                return self._n_time_embed_trial(input, model, n - 1)
-            elif n == 0:
-                print(f"[WARN] Embedding failed after retries")
+            if not _is_input_error(e):
                 raise e
-        return res
+            if len(batch) == 1:
+                print(f"[WARN] Skipping text that cannot be embedded ({batch[0][:50]!r}): {e}")
+                return [(1, None)]
+            mid = len(batch) // 2
+            args = (model, retry_num, sleep_time, request_bucket, token_bucket, encoding_format)
+            return await self._aembed_chunk(batch[:mid], *args) + await self._aembed_chunk(batch[mid:], *args)
+
+    def _prepare(self, texts: list[str]|str, model: str):
+        """テキストを正規化し, キャッシュから取得できなかったテキストを求める.
 
-    def embed(self, texts: list[str]|str,  model: str = "text-embedding-3-small", retry_num: int=6, sleep_time: int=10) -> list[list[float]]:
+        Returns:
+            tuple: (正規化済みテキスト, キャッシュのヒット結果(キャッシュなしの場合None), APIに送るテキスト)
+        """
         if isinstance(texts, str):
             texts = [texts]
         texts = [text.replace("\n", " ") for text in texts]
-        if len(texts) > 2048:
-            # 分割して処理
-            embeddings = []
-            for i in range(0, len(texts), 2048):
-                batch = texts[i:i + 2048]
-                res = self._n_time_embed_trial(input=batch, model=model, n=retry_num, sleep_time=sleep_time)
-                embeddings.extend([data.embedding for data in res.data])
-            return embeddings
-        else:
-            res = self._n_time_embed_trial(input = texts, model=model, n=retry_num, sleep_time=sleep_time)
-            embeddings = [data.embedding for data in res.data]
-            return embeddings
+        if self.cache is None:
+            return texts, None, texts
+
+        # 呼び出し内の重複を除き, キャッシュにないテキストだけをAPIに送る
+        unique_texts = list(dict.fromkeys(texts))
+        found = self.cache.get_many(model, unique_texts)
+        missing = [text for text in unique_texts if text not in found]
+        if self.hooks is not None:
+            self.hooks("cache", component="openai", endpoint=model, hits=len(found), misses=len(missing))
+        return texts, found, missing
+
+    def _finish(self, texts: list[str], found: dict | None, missing: list[str], fetched: list[list[float]] | np.ndarray, model: str, as_array: bool = False) -> list[list[float]] | np.ndarray:
+        """APIから取得した埋め込みをキャッシュに保存し, 入力順に並べて返す."""
+        if found is None:
+            return fetched
+        if missing:
+            # スキップしたテキストはキャッシュしない
+            if as_array:
+                valid = ~np.isnan(fetched).any(axis=1)
+            else:
+                valid = [embedding is not None for embedding in fetched]
+            self.cache.put_many(
+                model,
+                [text for text, ok in zip(missing, valid) if ok],
+                [embedding for embedding, ok in zip(fetched, valid) if ok],
+            )
+        fetched_index = {text: i for i, text in enumerate(missing)}
+        if not as_array:
+            return [
+                fetched[fetched_index[text]] if text in fetched_index else found[text].tolist() for text in texts
+            ]
+
+        # ヒットした行とAPIから取得した行を, 確保済みの1つの行列に直接書き込む
+        dim = len(next(iter(found.values()))) if found else fetched.shape[1]
+        # すべてスキップされた場合はfetchedの幅が0になるので, その行はNaNにする
+        fetched_valid = len(missing) > 0 and fetched.shape[1] == dim
+        embeddings = np.empty((len(texts), dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            j = fetched_index.get(text)
+            if j is None:
+                embeddings[i] = found[text]
+            elif fetched_valid:
+                embeddings[i] = fetched[j]
+            else:
+                embeddings[i] = np.nan
+        return embeddings
+
+    def _embed_batches(self, texts: list[str], model: str, retry_num: int, sleep_time: int, as_array: bool = False, max_batch_tokens: int = MAX_BATCH_TOKENS) -> list[list[float]] | np.ndarray:
+        # 件数とトークン数の上限に収まるように分割して処理
+        encoding_format = "base64" if as_array else None
+        pieces = []
+        for batch, _ in _split_batches(texts, max_batch_tokens):
+            pieces.extend(self._embed_chunk(batch, model, retry_num, sleep_time, encoding_format))
+        return _assemble(pieces, as_array, model)
+
+    async def _aembed_batches(
+        self,
+        texts: list[str],
+        model: str,
+        retry_num: int,
+        sleep_time: int,
+        max_concurrency: int,
+        requests_per_minute: float | None,
+        tokens_per_minute: float | None,
+        as_array: bool = False,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+    ) -> list[list[float]] | np.ndarray:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        request_bucket = AsyncTokenBucket(requests_per_minute) if requests_per_minute else None
+        token_bucket = AsyncTokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+        encoding_format = "base64" if as_array else None
+
+        async def run(batch, n_tokens):
+            async with semaphore:
+                return await self._aembed_chunk(
+                    batch, model, retry_num, sleep_time, request_bucket, token_bucket, encoding_format, n_tokens
+                )
+
+        # gatherは入力順に結果を返すので, 完了順に関係なく出力順は入力と一致する
+        results = await asyncio.gather(*(run(batch, n_tokens) for batch, n_tokens in _split_batches(texts, max_batch_tokens)))
+        return _assemble([piece for pieces in results for piece in pieces], as_array, model)
+
+    def embed(self, texts: list[str]|str,  model: str = "text-embedding-3-small", retry_num: int=6, sleep_time: int=10, as_array: bool=False, max_batch_tokens: int=MAX_BATCH_TOKENS) -> list[list[float]] | np.ndarray:
+        """テキストの埋め込みを取得する.
+
+        as_array=Trueの場合は encoding_format="base64" でリクエストし, floatのリストを経由せずに
+        (件数, 次元数) のfloat32配列を返す.
+        1リクエストは最大2048件かつ見積もりトークン数max_batch_tokens以下に分割する.
+        不正なテキストで失敗したバッチは分割して原因のテキストだけをスキップし, その位置はNone(配列の場合NaNの行)になる.
+        """
+        texts, found, missing = self._prepare(texts, model)
+        fetched = self._embed_batches(missing, model, retry_num, sleep_time, as_array, max_batch_tokens)
+        return self._finish(texts, found, missing, fetched, model, as_array)
+
+    async def aembed(
+        self,
+        texts: list[str]|str,
+        model: str = "text-embedding-3-small",
+        retry_num: int = 6,
+        sleep_time: int = 10,
+        max_concurrency: int = 8,
+        requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None,
+        as_array: bool = False,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+    ) -> list[list[float]] | np.ndarray:
+        """チャンクを並行してAPIに送り, 埋め込みを取得する. 分割やスキップの扱いはembedと同じ.
+
+        Args:
+            texts (list[str] | str): 埋め込みたいテキスト
+            model (str): 埋め込みモデル名
+            retry_num (int): チャンクごとの最大リトライ回数
+            sleep_time (int): リトライ前の待機秒数
+            max_concurrency (int): 同時に送るリクエストの最大数
+            requests_per_minute (float | None): 1分あたりのリクエスト数の上限. Noneの場合は制限しない
+            tokens_per_minute (float | None): 1分あたりのトークン数の上限. Noneの場合は制限しない
+            as_array (bool): Trueの場合はbase64でリクエストし, float32配列で返す
+            max_batch_tokens (int): 1リクエストあたりの見積もりトークン数の上限
+        Returns:
+            list[list[float]] | np.ndarray: 入力と同じ順序の埋め込み
+        """
+        texts, found, missing = self._prepare(texts, model)
+        fetched = await self._aembed_batches(
+            missing, model, retry_num, sleep_time, max_concurrency, requests_per_minute, tokens_per_minute, as_array,
+            max_batch_tokens,
+        )
+        return self._finish(texts, found, missing, fetched, model, as_array)
+
+    def embed_concurrent(self, texts: list[str]|str, **kwargs) -> list[list[float]] | np.ndarray:
+        """aembedの同期版. 引数はaembedと同じ.
+
+        Jupyterなどすでにイベントループが動いている環境でも使えるよう, 専用スレッドのイベントループで実行する.
+        """
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(self.aembed(texts, **kwargs), self._loop).result()
     
+    def embed_iter(self, texts: Iterable[str], model: str = "text-embedding-3-small", batch_size: int = 2048, retry_num: int = 6, sleep_time: int = 10) -> Iterator[np.ndarray]:
+        """イテラブルなテキストをbatch_size件ずつ埋め込み, float32配列として逐次返す.
+
+        Args:
+            texts (Iterable[str]): 埋め込みたいテキスト. 必要な分だけ読み進める
+            model (str): 埋め込みモデル名
+            batch_size (int): 1回に処理する件数
+            retry_num (int): 最大リトライ回数
+            sleep_time (int): リトライ前の待機秒数
+        Yields:
+            np.ndarray: (バッチの件数, 次元数) のfloat32配列
+        """
+        texts = iter(texts)
+        while True:
+            batch = list(itertools.islice(texts, batch_size))
+            if not batch:
+                return
+            yield self.embed(batch, model=model, retry_num=retry_num, sleep_time=sleep_time, as_array=True)
+
+    def embed_to_memmap(self, texts: Iterable[str], path: str, n_texts: int | None = None, model: str = "text-embedding-3-small", batch_size: int = 2048, retry_num: int = 6, sleep_time: int = 10) -> np.memmap:
+        """埋め込みをバッチごとに.npyファイルへ直接書き込む.
+
+        書き込んだ件数を `path + ".ckpt.json"` に記録するため, 途中で落ちた場合も同じ引数で呼び直せば
+        最後に完了したバッチの続きから再開する.
+
+        Args:
+            texts (Iterable[str]): 埋め込みたいテキスト. 再開時も先頭から同じ順序で渡す
+            path (str): 書き込む.npyファイルのパス
+            n_texts (int | None): テキストの件数. textsがlenを持たない場合は必須
+            model (str): 埋め込みモデル名
+            batch_size (int): 1回に処理する件数. 完了したバッチごとにチェックポイントを更新する
+            retry_num (int): 最大リトライ回数
+            sleep_time (int): リトライ前の待機秒数
+        Returns:
+            np.memmap: (n_texts, 次元数) のfloat32配列
+        """
+        if n_texts is None:
+            if not hasattr(texts, "__len__"):
+                raise ValueError("n_texts is required when texts has no len()")
+            n_texts = len(texts)
+        checkpoint_path = path + ".ckpt.json"
+
+        n_done = 0
+        matrix = None
+        if os.path.exists(checkpoint_path) and os.path.exists(path):
+            with open(checkpoint_path) as f:
+                checkpoint = json.load(f)
+            if checkpoint["n_texts"] != n_texts or checkpoint["model"] != model:
+                raise ValueError(f"Checkpoint {checkpoint_path} does not match this job: {checkpoint}")
+            n_done = checkpoint["n_done"]
+            matrix = np.load(path, mmap_mode="r+")
+            if n_done:
+                print(f"[INFO] Resuming from {n_done}/{n_texts}")
+
+        texts = itertools.islice(texts, n_done, n_texts)
+        # すべてのテキストがスキップされたバッチは次元数が0になるので, 次元数がわかるまでファイルを作らない
+        n_unwritten_from = n_done
+        for batch in self.embed_iter(texts, model=model, batch_size=batch_size, retry_num=retry_num, sleep_time=sleep_time):
+            if matrix is None:
+                if batch.shape[1] == 0:
+                    n_done += len(batch)
+                    continue
+                # 次元数は最初に埋め込めたバッチの結果から決まる. それまでにスキップした行はNaNにする
+                matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(n_texts, batch.shape[1]))
+                matrix[n_unwritten_from:n_done] = np.nan
+            matrix[n_done:n_done + len(batch)] = batch if batch.shape[1] else np.nan
+            matrix.flush()
+            n_done += len(batch)
+            # チェックポイントは書き込み途中で落ちても壊れないように置き換えで更新する
+            with open(checkpoint_path + ".tmp", "w") as f:
+                json.dump({"n_done": n_done, "n_texts": n_texts, "model": model}, f)
+            os.replace(checkpoint_path + ".tmp", checkpoint_path)
+
+        if n_done < n_texts:
+            raise ValueError(f"texts ended after {n_done} of {n_texts} items")
+        if matrix is None:
+            raise ValueError("None of the texts could be embedded, so the embedding dimension is unknown")
+        return matrix
+
     def dimension_reduction(self, embeddings, dimension=256):
+        """埋め込みを先頭dimension次元に切り詰め, L2正規化する. 入力は変更しない.
+
+        ndarrayを渡した場合はリストに戻さず, 先頭dimension列だけをコピーした連続な配列を正規化して返す.
+        元の幅の配列を参照しないため, 入力を捨てればそのメモリは解放される.
+        リストを渡した場合は従来どおり新しいリストを返す.
+        """
+        if isinstance(embeddings, np.ndarray):
+            dtype = embeddings.dtype if np.issubdtype(embeddings.dtype, np.floating) else np.float32
+            reduced = np.array(embeddings[..., :dimension], dtype=dtype, order="C")
+            norm = np.linalg.norm(reduced, axis=-1, keepdims=True)
+            np.divide(reduced, norm, out=reduced, where=norm != 0)
+            return reduced
         embeddings = np.array([embedding[:dimension] for embedding in embeddings])
         if embeddings.ndim == 1:
             norm = np.linalg.norm(embeddings)
@@ -45,4 +555,4 @@ class Embedding:
             return embeddings / norm
         else:
             norm = np.linalg.norm(embeddings, 2, axis=1, keepdims=True)
-            return np.where(norm == 0, embeddings, embeddings / norm).tolist()
\ No newline at end of file
+            return np.where(norm == 0, embeddings, embeddings / norm).tolist()
@@ -0,0 +1,155 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """(model, 正規化済みテキストのハッシュ) をキーとして埋め込みベクトルをSQLiteに永続化するキャッシュ.
+
+    ベクトルはAPIの精度に合わせてfloat32のバイト列として保存する.
+    max_bytes を指定した場合, 合計サイズが上限を超えると最終アクセスが古いものから削除する.
+    """
+
+    # SQLiteのプレースホルダ数の上限を超えないようにまとめて問い合わせる件数
+    _QUERY_CHUNK = 500
+
+    def __init__(self, path: str = "embedding_cache.sqlite3", max_bytes: int | None = None):
+        """
+        Args:
+            path (str): SQLiteファイルのパス
+            max_bytes (int | None): 保存するベクトルの合計バイト数の上限. Noneの場合は無制限
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                key TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                nbytes INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, key)
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(text: str) -> str:
+        """正規化済みテキストからキャッシュキーを求める."""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, texts: list[str]) -> dict[str, np.ndarray]:
+        """キャッシュに存在するテキストの埋め込みをまとめて取得する.
+
+        埋め込みはfloatのリストに変換せず, 保存されたバイト列をそのまま参照する読み取り専用のfloat32配列で返す.
+
+        Args:
+            model (str): 埋め込みモデル名
+            texts (list[str]): 正規化済みのテキスト（重複なし）
+        Returns:
+            dict[str, np.ndarray]: ヒットしたテキストとその埋め込み(float32の1次元配列)の辞書
+        """
+        keys = {self.key(text): text for text in texts}
+        found = {}
+        now = time.time()
+        with self._lock:
+            key_list = list(keys)
+            for i in range(0, len(key_list), self._QUERY_CHUNK):
+                chunk = key_list[i:i + self._QUERY_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE model = ? AND key IN ({placeholders})",
+                    [model, *chunk],
+                ).fetchall()
+                for key, vector in rows:
+                    found[keys[key]] = np.frombuffer(vector, dtype=np.float32)
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND key = ?",
+                    [(now, model, key) for key, _ in rows],
+                )
+            self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(texts) - len(found)
+        return found
+
+    def put_many(self, model: str, texts: list[str], embeddings: list[list[float]]):
+        """テキストと埋め込みの組をまとめて保存する.
+
+        Args:
+            model (str): 埋め込みモデル名
+            texts (list[str]): 正規化済みのテキスト
+            embeddings (list[list[float]]): textsに対応する埋め込み
+        """
+        now = time.time()
+        rows = []
+        for text, embedding in zip(texts, embeddings):
+            vector = np.asarray(embedding, dtype=np.float32).tobytes()
+            rows.append((model, self.key(text), vector, len(vector), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, key, vector, nbytes, last_access) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            if self.max_bytes is not None:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """合計サイズがmax_bytesを超えている場合, 最終アクセスが古いものから削除する."""
+        total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        freed = 0
+        for model, key, nbytes in self._conn.execute(
+            "SELECT model, key, nbytes FROM embeddings ORDER BY last_access"
+        ):
+            if freed >= excess:
+                break
+            victims.append((model, key))
+            freed += nbytes
+        self._conn.executemany("DELETE FROM embeddings WHERE model = ? AND key = ?", victims)
+
+    def stats(self) -> dict:
+        """ヒット数・ミス数・保存件数・合計バイト数を返す."""
+        with self._lock:
+            entries, nbytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM embeddings"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": nbytes,
+        }
+
+    def clear(self):
+        """保存されている埋め込みとカウンタをすべて削除する."""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
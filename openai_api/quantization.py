@@ -0,0 +1,188 @@
+import numpy as np
+
+# ブロック処理で一度に確保する一時配列の目安（バイト）
+_BLOCK_BYTES = 64 * 1024 * 1024
+
+if hasattr(np, "bitwise_count"):
+    _popcount = np.bitwise_count
+else:
+    # NumPy 2.0未満では8bitごとのテーブルで数える
+    _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def _popcount(x):
+        return _POPCOUNT_TABLE[x.view(np.uint8)].reshape(*x.shape, -1).sum(axis=-1, dtype=np.uint8)
+
+
+def _as_2d_float32(embeddings) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    return embeddings[np.newaxis, :] if embeddings.ndim == 1 else embeddings
+
+
+def quantize_int8(embeddings) -> tuple[np.ndarray, np.ndarray]:
+    """ベクトルごとのスケールでint8にスカラー量子化する. メモリはfloat32の1/4になる.
+
+    Args:
+        embeddings (np.ndarray or list): (n, d) の埋め込み
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (n, d) のint8コードと, (n,) のfloat32スケール. 元のベクトルは codes * scales[:, None] で近似できる
+    """
+    embeddings = _as_2d_float32(embeddings)
+    scales = np.abs(embeddings).max(axis=1) / 127
+    safe_scales = np.where(scales > 0, scales, 1)
+    codes = np.rint(embeddings / safe_scales[:, np.newaxis]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    """quantize_int8の結果からfloat32のベクトルを復元する."""
+    return codes.astype(np.float32) * scales[:, np.newaxis]
+
+
+def quantize_binary(embeddings) -> np.ndarray:
+    """各次元の符号だけを残す1bit量子化. メモリはfloat32の1/32になる.
+
+    Args:
+        embeddings (np.ndarray or list): (n, d) の埋め込み
+    Returns:
+        np.ndarray: (n, ceil(d / 8)) のuint8にビットを詰めたコード
+    """
+    return np.packbits(_as_2d_float32(embeddings) > 0, axis=1)
+
+
+def int8_similarity(codes_a: np.ndarray, scales_a: np.ndarray, codes_b: np.ndarray, scales_b: np.ndarray, block_bytes: int = _BLOCK_BYTES) -> np.ndarray:
+    """int8コード同士の内積を求める. 入力が正規化済みであればコサイン類似度の近似になる.
+
+    NumPyには高速なint8の行列積がないため, 行ブロックごとにfloat32へ変換してBLASで計算する.
+    d <= 1040 であればint8の内積はfloat32で誤差なく表現できる.
+
+    Args:
+        block_bytes (int): 片側のブロックをfloat32に変換した配列の大きさの上限（バイト）
+    Returns:
+        np.ndarray: (n, m) のfloat32配列
+    """
+    result = np.empty((len(codes_a), len(codes_b)), dtype=np.float32)
+    # コーパス全体をfloat32に戻さないよう, 両側とも一定サイズのブロックずつ変換する
+    block = max(1, block_bytes // (4 * codes_a.shape[1]))
+    for start_a in range(0, len(codes_a), block):
+        a = codes_a[start_a:start_a + block].astype(np.float32)
+        for start_b in range(0, len(codes_b), block):
+            b = codes_b[start_b:start_b + block].astype(np.float32)
+            # 積の一時配列を作らず, 結果の該当部分に直接書き込む
+            np.matmul(a, b.T, out=result[start_a:start_a + block, start_b:start_b + block])
+    result *= scales_a[:, np.newaxis]
+    result *= scales_b[np.newaxis, :]
+    return result
+
+
+def hamming_distance(bits_a: np.ndarray, bits_b: np.ndarray) -> np.ndarray:
+    """quantize_binaryのコード同士のハミング距離を, XORとpopcountで求める.
+
+    Returns:
+        np.ndarray: (n, m) のint32配列
+    """
+    # 8バイト単位でXORできるように末尾をゼロ埋めしてuint64として扱う
+    n_bytes = bits_a.shape[1]
+    pad = (-n_bytes) % 8
+    if pad:
+        bits_a = np.pad(bits_a, ((0, 0), (0, pad)))
+        bits_b = np.pad(bits_b, ((0, 0), (0, pad)))
+    words_a = np.ascontiguousarray(bits_a).view(np.uint64)
+    # 64bitの列ごとに (ブロック行数, m) の距離へ足し込むため, bは列方向に連続にしておく
+    words_b = np.ascontiguousarray(np.ascontiguousarray(bits_b).view(np.uint64).T)
+
+    result = np.zeros((len(words_a), words_b.shape[1]), dtype=np.int32)
+    block = max(1, _BLOCK_BYTES // (8 * words_b.shape[1] + 1))
+    for start in range(0, len(words_a), block):
+        out = result[start:start + block]
+        for j in range(words_b.shape[0]):
+            out += _popcount(words_a[start:start + block, j, np.newaxis] ^ words_b[j])
+    return result
+
+
+def binary_similarity(bits_a: np.ndarray, bits_b: np.ndarray, dimension: int) -> np.ndarray:
+    """ハミング距離を [-1, 1] の類似度に変換する. 一致するビットの割合から 1 - 2 * hamming / dimension で求める."""
+    similarity = hamming_distance(bits_a, bits_b).astype(np.float32)
+    similarity *= -2 / dimension
+    similarity += 1
+    return similarity
+
+
+def quantized_top_k(queries, codes: np.ndarray, scales: np.ndarray | None = None, k: int = 10, rerank_embeddings=None, n_candidates: int | None = None, memory_budget: int = _BLOCK_BYTES) -> tuple[np.ndarray, np.ndarray]:
+    """量子化されたコーパスから各クエリに類似する上位k件を求める.
+
+    scalesを指定した場合はint8コード, 指定しない場合はquantize_binaryのコードとして扱う.
+    rerank_embeddingsを指定した場合は, 量子化した類似度で上位n_candidates件を選んだ後に
+    floatのベクトルで並べ替えて上位k件を返す.
+    (q, N) の類似度行列全体は確保せず, コーパスをタイルに分けてタイルごとの上位件数を統合する.
+
+    Args:
+        queries (np.ndarray or list): (q, d) のクエリの埋め込み（正規化済み）
+        codes (np.ndarray): コーパスのint8コードまたはバイナリコード
+        scales (np.ndarray | None): int8コードのスケール
+        k (int): 返す件数
+        rerank_embeddings (np.ndarray | None): 再ランキングに使うコーパスのfloatの埋め込み（正規化済み）
+        n_candidates (int | None): 再ランキングの候補数. Noneの場合は k * 4
+        memory_budget (int): 1タイルの類似度と上位件数の選択に使う作業用メモリの上限（バイト）
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (q, k) のインデックスと類似度（類似度の降順）
+    """
+    queries = _as_2d_float32(queries)
+    if scales is not None:
+        query_codes, query_scales = quantize_int8(queries)
+    else:
+        query_bits = quantize_binary(queries)
+    n_queries, n = len(queries), len(codes)
+    n_keep = k if rerank_embeddings is None else (n_candidates or k * 4)
+    n_keep = min(n_keep, n)
+
+    # タイル1要素あたり, 類似度(float32)とその計算途中の配列, argpartitionのint64の添字を使う.
+    # 統合には行ごとに (類似度, 添字) の2 * n_keep列の候補と, それを選び直す添字を使う
+    # 予算の半分をタイルに, 残りをint8_similarityがfloat32に変換するクエリとコーパスのブロックに割り当てる
+    tile_budget = memory_budget // 2
+    element_bytes = 16
+    extra_cols = 4 * n_keep
+    # int8はタイルごとにコーパスをfloat32に変換し直すため, クエリの行はなるべく1つのタイルにまとめ,
+    # 列を少なくとも4096列は確保できる行数で区切る
+    rows = min(n_queries, max(1, tile_budget // (element_bytes * (min(n, 4096) + extra_cols))))
+    cols = min(n, max(1, tile_budget // (element_bytes * rows) - extra_cols))
+
+    best_scores = np.full((n_queries, n_keep), -np.inf, dtype=np.float32)
+    best_indices = np.zeros((n_queries, n_keep), dtype=np.int64)
+    for row in range(0, n_queries, rows):
+        query_rows = slice(row, row + rows)
+        for col in range(0, n, cols):
+            if scales is not None:
+                scores = int8_similarity(
+                    query_codes[query_rows], query_scales[query_rows], codes[col:col + cols], scales[col:col + cols],
+                    block_bytes=memory_budget // 4,
+                )
+            else:
+                scores = binary_similarity(query_bits[query_rows], codes[col:col + cols], queries.shape[1])
+            # タイルの中で先に上位n_keep件に絞る. 符号はその場で反転し, 類似度のコピーを作らない
+            if scores.shape[1] > n_keep:
+                np.negative(scores, out=scores)
+                top = np.argpartition(scores, n_keep - 1, axis=1)[:, :n_keep].copy()
+                tile_scores = -np.take_along_axis(scores, top, axis=1)
+                tile_indices = top + col
+            else:
+                tile_scores = scores
+                tile_indices = np.broadcast_to(np.arange(col, col + scores.shape[1]), scores.shape)
+            del scores
+
+            candidate_scores = np.concatenate([best_scores[query_rows], tile_scores], axis=1)
+            candidate_indices = np.concatenate([best_indices[query_rows], tile_indices], axis=1)
+            top = np.argpartition(-candidate_scores, n_keep - 1, axis=1)[:, :n_keep]
+            best_scores[query_rows] = np.take_along_axis(candidate_scores, top, axis=1)
+            best_indices[query_rows] = np.take_along_axis(candidate_indices, top, axis=1)
+
+    candidates = best_indices
+    if rerank_embeddings is not None:
+        rerank_embeddings = np.asarray(rerank_embeddings)
+        # 候補だけをfloatで計算し直す
+        scores = np.einsum("qd,qcd->qc", queries, rerank_embeddings[candidates].astype(np.float32, copy=False))
+    else:
+        scores = best_scores
+
+    k = min(k, candidates.shape[1])
+    order = np.argsort(-scores, axis=1)[:, :k]
+    return np.take_along_axis(candidates, order, axis=1), np.take_along_axis(scores, order, axis=1)
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+
+class AsyncTokenBucket:
+    """1分あたりの予算を一定速度で補充するasyncio用のトークンバケット.
+
+    リクエスト数(RPM)とトークン数(TPM)の両方の制限に使う.
+    """
+
+    def __init__(self, per_minute: float, capacity: float | None = None):
+        """
+        Args:
+            per_minute (float): 1分あたりに補充される量
+            capacity (float | None): バケットの最大容量. Noneの場合はper_minuteと同じ
+        """
+        if per_minute <= 0:
+            raise ValueError(f"per_minute must be positive: {per_minute}")
+        self.rate = per_minute / 60.0
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    @property
+    def available(self) -> float:
+        """現在利用できる量."""
+        self._refill()
+        return self._tokens
+
+    async def acquire(self, amount: float = 1.0):
+        """amountだけ予算を消費する. 足りない場合は補充されるまで待つ.
+
+        容量を超えるamountはバケットが満杯になった時点で消費し, 超過分は後続の待ち時間として扱う.
+        """
+        async with self._lock:
+            need = min(amount, self.capacity)
+            while True:
+                self._refill()
+                if self._tokens >= need:
+                    break
+                await asyncio.sleep((need - self._tokens) / self.rate)
+            self._tokens -= amount
+
+    def drain(self):
+        """429を受け取った場合などに, 残りの予算を0にして補充を待たせる."""
+        self._refill()
+        self._tokens = min(self._tokens, 0.0)
@@ -0,0 +1,136 @@
+import asyncio
+import base64
+import random
+import threading
+import time
+import zlib
+from typing import Callable, Iterable
+
+import numpy as np
+
+
+class FakeAPIError(Exception):
+    """OpenAIのAPIエラーと同じく status_code と response.headers を持つ例外."""
+
+    def __init__(self, status_code: int, retry_after: float | None = None):
+        super().__init__(f"Error code: {status_code}")
+        self.status_code = status_code
+        headers = {"retry-after-ms": str(retry_after * 1000)} if retry_after is not None else {}
+        self.response = type("Response", (), {"headers": headers})()
+
+
+class _Data:
+    def __init__(self, embedding):
+        self.embedding = embedding
+
+
+class _Response:
+    def __init__(self, data):
+        self.data = data
+
+
+class _FakeEmbeddings:
+    def __init__(self, owner):
+        self.owner = owner
+
+    def create(self, input, model, encoding_format=None):
+        self.owner._before_request(input)
+        time.sleep(self.owner._latency(input))
+        return self.owner._response(input, encoding_format)
+
+
+class _AsyncFakeEmbeddings:
+    def __init__(self, owner):
+        self.owner = owner
+
+    async def create(self, input, model, encoding_format=None):
+        self.owner._before_request(input)
+        await asyncio.sleep(self.owner._latency(input))
+        return self.owner._response(input, encoding_format)
+
+
+class FakeOpenAI:
+    """Embedding.client / Embedding.async_client の代わりに使う, ネットワークを使わないクライアント.
+
+    リクエストごとにlatency秒待ち, rate_limit_probabilityの確率で429を返す.
+    同期版は .embeddings, 非同期版は .async_view().embeddings を使う.
+    埋め込みはテキストごとに決まり, 期待値は vector_for で求められる.
+
+    Example:
+        client = FakeOpenAI(dimension=8, latency=0.01)
+        embedding = Embedding(api_key="test")
+        embedding.client = client
+        embedding.async_client = client.async_view()
+    """
+
+    def __init__(
+        self,
+        dimension: int = 1536,
+        latency: float | Callable[[list[str]], float] = 0.05,
+        rate_limit_probability: float = 0.0,
+        retry_after: float | None = 0.05,
+        seed: int = 0,
+        rate_limit_requests: Iterable[int] = (),
+    ):
+        """
+        Args:
+            dimension (int): 返す埋め込みの次元数
+            latency (float | Callable[[list[str]], float]): 1リクエストあたりの待ち時間(秒). 関数の場合は入力から求める
+            rate_limit_probability (float): 429を返す確率
+            retry_after (float | None): 429のretry-afterに入れる秒数. Noneの場合はヘッダを付けない
+            seed (int): 埋め込みと429を起こす乱数のシード
+            rate_limit_requests (Iterable[int]): 必ず429を返すリクエストの番号(0始まり)
+        """
+        self.dimension = dimension
+        self.latency = latency
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after = retry_after
+        self.rate_limit_requests = set(rate_limit_requests)
+        self.requests = 0
+        self.rate_limited = 0
+        self.items = 0
+        # (time.monotonic()での開始時刻, 件数, 429を返したか) の記録
+        self.request_log = []
+        # 応答を返したリクエストの入力を完了順に記録する
+        self.completed = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.embeddings = _FakeEmbeddings(self)
+        self._base = np.random.default_rng(seed).standard_normal(dimension).astype("<f4")
+
+    def async_view(self):
+        view = type("AsyncFakeOpenAI", (), {})()
+        view.embeddings = _AsyncFakeEmbeddings(self)
+        return view
+
+    def vector_for(self, text: str) -> np.ndarray:
+        """textに対して返す埋め込み. 先頭の要素だけをテキストのハッシュにする."""
+        vector = self._base.copy()
+        vector[0] = zlib.crc32(text.encode("utf-8")) % 2 ** 24
+        return vector
+
+    def _latency(self, input: list[str]) -> float:
+        return self.latency(input) if callable(self.latency) else self.latency
+
+    def _before_request(self, input: list[str]):
+        with self._lock:
+            number = self.requests
+            self.requests += 1
+            rate_limited = number in self.rate_limit_requests or self._random.random() < self.rate_limit_probability
+            self.request_log.append((time.monotonic(), len(input), rate_limited))
+            if rate_limited:
+                self.rate_limited += 1
+            else:
+                self.items += len(input)
+        if rate_limited:
+            raise FakeAPIError(429, self.retry_after)
+
+    def _response(self, input, encoding_format):
+        vectors = [self.vector_for(text) for text in input]
+        if encoding_format == "base64":
+            data = [_Data(base64.b64encode(vector.tobytes()).decode("ascii")) for vector in vectors]
+        else:
+            data = [_Data(vector.tolist()) for vector in vectors]
+        with self._lock:
+            self.completed.append(list(input))
+        return _Response(data)
@@ -10,7 +10,7 @@ sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 from utils.comparison.cosine_similarity import cosine_similarity, flatten_self_sim_df
 from utils.comparison.entropy import get_entropy, get_entropy_all
 from utils.comparison.js_divergence import get_js_divergence_at_once
-from utils.threading_process import run_in_executor
+from utils.threading_process import WorkerPool, run_in_executor
 
 
 def sample_threading():
@@ -31,6 +31,12 @@ def sample_threading():
         res1 = future1.result()
         res2 = future2.result()
         print(f"Got results: {res1}, {res2}")
+
+        # WorkerPool を使用して複数のタスクを並行実行（完了した順に結果を受け取る）
+        with WorkerPool(max_workers=3) as pool:
+            tasks = [("C", 1.5), ("D", 0.5), ("E", 1)]
+            for result in pool.map(lambda task: heavy_task(*task), tasks, ordered=False):
+                print(f"Got result: {result}")
     except Exception as e:
         print(f"Error in threading sample: {e}")
 
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import numpy as np
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.comparison.ann_index import IVFIndex
+
+
+def _exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    corpus = corpus / np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+    return np.argsort(-(queries @ corpus.T), axis=1)[:, :k]
+
+
+def test_search_on_empty_index_returns_placeholders(tmp_path):
+    rng = np.random.default_rng(0)
+    index = IVFIndex(n_lists=8).train(rng.standard_normal((100, 16)))
+    index.save(tmp_path)
+
+    for searched in (index, IVFIndex.load(tmp_path)):
+        ids, scores = searched.search(rng.standard_normal((3, 16)), k=4)
+        assert (ids == -1).all()
+        assert np.isneginf(scores).all()
+
+
+def test_incremental_add_after_load_matches_exact_search(tmp_path):
+    rng = np.random.default_rng(0)
+    corpus = rng.standard_normal((3000, 16)).astype(np.float32)
+    queries = rng.standard_normal((20, 16)).astype(np.float32)
+    # 全クラスタを調べれば厳密な検索と一致する
+    index = IVFIndex(n_lists=8, n_probe=8).train(corpus)
+    index.add(corpus[:1000]).add(corpus[1000:2000])
+    index.save(tmp_path)
+
+    loaded = IVFIndex.load(tmp_path)
+    loaded.add(corpus[2000:])
+    # 追加しても保存済みのベクトルはメモリマップのまま
+    assert isinstance(loaded._vectors, np.memmap)
+    assert len(loaded) == 3000
+    ids, _ = loaded.search(queries, k=5)
+    np.testing.assert_array_equal(ids, _exact_top_k(corpus, queries, 5))
+
+    loaded.save(tmp_path)
+    assert isinstance(loaded._vectors, np.memmap)
+    reloaded = IVFIndex.load(tmp_path, mmap=False)
+    np.testing.assert_array_equal(reloaded.search(queries, k=5)[0], ids)
+    assert reloaded.add(corpus[:1])._next_id == 3001
@@ -0,0 +1,42 @@
+import json
+import os
+import sys
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from twitter_api.archive import ArchiveWriter, iter_archive
+
+
+def _page(next_token: str | None) -> dict:
+    meta = {"next_token": next_token} if next_token is not None else {}
+    return {"response": {"data": [{"id": "1"}], "meta": meta}}
+
+
+def test_checkpoints_append_one_line_per_write_and_compact_on_open(tmp_path):
+    with ArchiveWriter(str(tmp_path)) as writer:
+        for i in range(3):
+            writer.write(_page(str(i)), key="a")
+        writer.write(_page(None), key="b")
+        with open(writer.checkpoint_path) as f:
+            assert len(f.readlines()) == 4
+
+    # 書き込み途中で途切れた行は無視する
+    with open(writer.checkpoint_path, "a") as f:
+        f.write('["a", {"next_')
+
+    with ArchiveWriter(str(tmp_path)) as reopened:
+        assert reopened.checkpoint("a") == {"next_token": "2", "done": False}
+        assert reopened.checkpoint("b") == {"next_token": None, "done": True}
+        with open(reopened.checkpoint_path) as f:
+            assert len(f.readlines()) == 2
+    assert len(list(iter_archive(str(tmp_path)))) == 4
+
+
+def test_legacy_checkpoint_file_is_migrated(tmp_path):
+    with open(tmp_path / "crawl.checkpoint.json", "w") as f:
+        json.dump({"a": {"next_token": "x", "done": False}}, f)
+
+    with ArchiveWriter(str(tmp_path)) as writer:
+        assert writer.checkpoint("a") == {"next_token": "x", "done": False}
+    assert not (tmp_path / "crawl.checkpoint.json").exists()
@@ -0,0 +1,59 @@
+import os
+import sys
+
+import numpy as np
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.comparison.cosine_similarity import (
+    PairHistogram,
+    PairMoments,
+    PairsAboveThreshold,
+    cosine_similarity,
+    cosine_similarity_topk,
+    stream_self_similarity,
+)
+
+
+def test_topk_matches_full_matrix_for_any_tile_size():
+    rng = np.random.default_rng(0)
+    a = rng.standard_normal((300, 16))
+    b = rng.standard_normal((1000, 16))
+    similarity = cosine_similarity(a, b).values
+    expected = np.argsort(-similarity, axis=1)[:, :7]
+
+    # 1タイルが数行になる予算から, 全体が1タイルに収まる予算まで
+    for memory_budget in (1000, 10_000, 256 * 1024 ** 2):
+        indices, scores = cosine_similarity_topk(a, b, k=7, memory_budget=memory_budget, dtype=np.float64)
+        np.testing.assert_array_equal(indices, expected)
+        np.testing.assert_allclose(scores, np.take_along_axis(similarity, expected, axis=1))
+
+
+def test_topk_excludes_self():
+    rng = np.random.default_rng(0)
+    a = rng.standard_normal((200, 16))
+    similarity = cosine_similarity(a, a).to_numpy(copy=True)
+    np.fill_diagonal(similarity, -np.inf)
+
+    indices, _ = cosine_similarity_topk(a, a, k=3, memory_budget=10_000, dtype=np.float64, exclude_self=True)
+    np.testing.assert_array_equal(indices, np.argsort(-similarity, axis=1)[:, :3])
+
+
+def test_stream_self_similarity_matches_upper_triangle():
+    rng = np.random.default_rng(0)
+    a = rng.standard_normal((500, 16))
+    similarity = cosine_similarity(a, a).values
+    pairs = similarity[np.triu_indices_from(similarity, k=1)]
+
+    # 小さい予算でブロックと, consumerに渡す行の分割の両方を使う
+    histogram, moments, above = PairHistogram(bins=20), PairMoments(), PairsAboveThreshold(0.5)
+    stream_self_similarity(a, [histogram, moments, above], memory_budget=50_000, dtype=np.float64)
+
+    np.testing.assert_array_equal(histogram.counts, np.histogram(pairs, bins=20, range=(-1, 1))[0])
+    assert moments.count == len(pairs)
+    assert np.isclose(moments.mean, pairs.mean())
+    assert np.isclose(moments.variance, pairs.var())
+    rows, cols, values = above.result()
+    assert (rows < cols).all()
+    np.testing.assert_allclose(np.sort(values), np.sort(pairs[pairs >= 0.5]))
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import sys
+
+import numpy as np
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from openai_api.embedding import Embedding
+from openai_api.embedding_cache import EmbeddingCache
+from openai_api.testing import FakeAPIError, FakeOpenAI
+
+
+class _RejectingOpenAI(FakeOpenAI):
+    """rejectedに含まれるテキストを入力に含むリクエストに400を返す."""
+
+    def __init__(self, rejected: set[str], **kwargs):
+        super().__init__(**kwargs)
+        self.rejected = rejected
+
+    def _before_request(self, input: list[str]):
+        super()._before_request(input)
+        if self.rejected.intersection(input):
+            raise FakeAPIError(400)
+
+
+def _embedding(client: FakeOpenAI, **kwargs) -> Embedding:
+    embedding = Embedding(api_key="test", **kwargs)
+    embedding.client = client
+    embedding.async_client = client.async_view()
+    return embedding
+
+
+def test_dimension_reduction_does_not_modify_input():
+    embeddings = np.random.default_rng(0).standard_normal((5, 64)).astype(np.float32)
+    original = embeddings.copy()
+    embedding = Embedding(api_key="test")
+
+    reduced_16 = embedding.dimension_reduction(embeddings, 16)
+    reduced_32 = embedding.dimension_reduction(embeddings, 32)
+
+    np.testing.assert_array_equal(embeddings, original)
+    assert reduced_16.flags.c_contiguous and not np.shares_memory(reduced_16, embeddings)
+    expected = original[:, :32] / np.linalg.norm(original[:, :32], axis=1, keepdims=True)
+    np.testing.assert_allclose(reduced_32, expected, rtol=1e-6)
+
+
+def test_embed_returns_nan_rows_when_every_text_is_skipped():
+    client = _RejectingOpenAI({"a", "b"}, dimension=1536, latency=0.0)
+
+    embeddings = _embedding(client).embed(["a", "b"], as_array=True)
+
+    assert embeddings.shape == (2, 1536)
+    assert np.isnan(embeddings).all()
+
+
+def test_bisects_batch_and_skips_only_the_rejected_text(tmp_path):
+    texts = [f"text {i}" for i in range(16)]
+    model = "text-embedding-3-small"
+
+    for mode in ("list", "array", "async"):
+        client = _RejectingOpenAI({"text 5"}, dimension=8, latency=0.0)
+        cache = EmbeddingCache(str(tmp_path / f"{mode}.sqlite3"))
+        embedding = _embedding(client, cache=cache)
+        if mode == "async":
+            result = asyncio.run(embedding.aembed(texts, model=model, as_array=True))
+        else:
+            result = embedding.embed(texts, model=model, as_array=mode == "array")
+
+        for i, text in enumerate(texts):
+            if i == 5:
+                assert result[i] is None if mode == "list" else np.isnan(result[i]).all()
+            else:
+                np.testing.assert_array_equal(np.asarray(result[i], dtype=np.float32), client.vector_for(text))
+        # 1つのバッチを半分ずつに分けて, 拒否されたテキストだけが1件のリクエストになるまで分割する
+        assert client.requests == 1 + 2 * 4
+        cached = cache.get_many(model, texts)
+        assert set(cached) == set(texts) - {"text 5"}
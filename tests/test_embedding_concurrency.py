@@ -0,0 +1,102 @@
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from openai_api.embedding import Embedding, _estimate_tokens
+from openai_api.testing import FakeOpenAI
+
+
+def _embedding(client: FakeOpenAI) -> Embedding:
+    embedding = Embedding(api_key="test")
+    embedding.client = client
+    embedding.async_client = client.async_view()
+    return embedding
+
+
+def _aembed(client: FakeOpenAI, texts: list[str], **kwargs):
+    kwargs.setdefault("sleep_time", 0.01)
+    return asyncio.run(_embedding(client).aembed(texts, **kwargs))
+
+
+def test_aembed_keeps_input_order_when_requests_complete_out_of_order():
+    texts = [f"text {i}" for i in range(40)]
+    # 先に送ったリクエストほど遅く返るようにする
+    client = FakeOpenAI(dimension=8, latency=lambda batch: 0.05 - 0.001 * int(batch[0].split()[1]))
+    max_batch_tokens = 4 * _estimate_tokens(texts[0])
+
+    for as_array in (False, True):
+        client.completed.clear()
+        result = _aembed(client, texts, max_concurrency=10, max_batch_tokens=max_batch_tokens, as_array=as_array)
+
+        completed = [batch[0] for batch in client.completed]
+        assert len(completed) == 10
+        assert completed != sorted(completed, key=texts.index)
+        np.testing.assert_array_equal(np.asarray(result, dtype=np.float32), [client.vector_for(text) for text in texts])
+
+
+def test_aembed_drains_buckets_on_rate_limit():
+    texts = [f"text {i}" for i in range(4)]
+    # retry-afterを0にして, 再送までの待ち時間がバケットの補充だけで決まるようにする
+    client = FakeOpenAI(dimension=8, latency=0.0, retry_after=0.0, rate_limit_requests=[0])
+    max_batch_tokens = _estimate_tokens(texts[0])
+
+    # 10リクエスト/秒. 429がなければ容量の範囲内なので待たずに送れる
+    result = _aembed(client, texts, max_concurrency=1, requests_per_minute=600, max_batch_tokens=max_batch_tokens)
+
+    assert client.rate_limited == 1
+    assert len(client.request_log) == 5
+    starts = [start for start, _, _ in client.request_log]
+    # 429の後はバケットが空になり, 以降のリクエストは1件ずつ補充を待つ
+    for previous, current in zip(starts, starts[1:]):
+        assert current - previous >= 0.08
+    np.testing.assert_array_equal(np.asarray(result, dtype=np.float32), [client.vector_for(text) for text in texts])
+
+
+def test_aembed_without_rate_limit_does_not_wait():
+    texts = [f"text {i}" for i in range(61)]
+    client = FakeOpenAI(dimension=8, latency=0.0)
+    max_batch_tokens = _estimate_tokens(texts[-1])
+
+    start = time.monotonic()
+    _aembed(client, texts, max_concurrency=4, max_batch_tokens=max_batch_tokens)
+    assert time.monotonic() - start < 0.5
+    assert client.requests == 61
+
+
+def test_aembed_paces_requests_per_minute():
+    texts = [f"text {i}" for i in range(61)]
+    client = FakeOpenAI(dimension=8, latency=0.0)
+    max_batch_tokens = _estimate_tokens(texts[-1])
+
+    # 容量の60件を使い切った後, 61件目は1秒後の補充を待つ
+    start = time.monotonic()
+    _aembed(client, texts, max_concurrency=4, requests_per_minute=60, max_batch_tokens=max_batch_tokens)
+    elapsed = time.monotonic() - start
+
+    assert client.requests == 61
+    assert 0.9 <= elapsed < 2.0
+    starts = sorted(start for start, _, _ in client.request_log)
+    assert starts[-1] - starts[0] >= 0.9
+
+
+def test_aembed_paces_tokens_per_minute():
+    texts = [f"text {i}" for i in range(20)]
+    client = FakeOpenAI(dimension=8, latency=0.0)
+    max_batch_tokens = 2 * _estimate_tokens(texts[-1])
+    total = sum(_estimate_tokens(text) for text in texts)
+
+    # 容量(=1分の予算)を使い切った後, 残りの1/61だけ1秒かけて補充される
+    tokens_per_minute = total * 60 / 61
+    start = time.monotonic()
+    result = _aembed(client, texts, max_concurrency=4, tokens_per_minute=tokens_per_minute, max_batch_tokens=max_batch_tokens)
+    elapsed = time.monotonic() - start
+
+    assert client.requests == 10
+    assert 0.9 <= elapsed < 2.0
+    np.testing.assert_array_equal(np.asarray(result, dtype=np.float32), [client.vector_for(text) for text in texts])
@@ -0,0 +1,51 @@
+import os
+import sys
+
+import numpy as np
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from openai_api.quantization import (
+    binary_similarity,
+    int8_similarity,
+    quantize_binary,
+    quantize_int8,
+    quantized_top_k,
+)
+
+
+def _normalized(rng, n: int, d: int) -> np.ndarray:
+    embeddings = rng.standard_normal((n, d)).astype(np.float32)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def test_quantized_top_k_matches_full_scores_for_any_tile_size():
+    rng = np.random.default_rng(0)
+    corpus = _normalized(rng, 3000, 32)
+    queries = _normalized(rng, 50, 32)
+    codes, scales = quantize_int8(corpus)
+    bits = quantize_binary(corpus)
+    cases = {
+        "int8": ((codes, scales), int8_similarity(*quantize_int8(queries), codes, scales)),
+        "binary": ((bits, None), binary_similarity(quantize_binary(queries), bits, 32)),
+    }
+
+    for name, ((corpus_codes, corpus_scales), scores) in cases.items():
+        expected = -np.sort(-scores, axis=1)[:, :5]
+        # タイルが数列になる予算から, 全体が1タイルに収まる予算まで
+        for memory_budget in (4000, 100_000, 64 * 1024 ** 2):
+            indices, top_scores = quantized_top_k(queries, corpus_codes, corpus_scales, k=5, memory_budget=memory_budget)
+            np.testing.assert_allclose(top_scores, expected, err_msg=name)
+            np.testing.assert_allclose(np.take_along_axis(scores, indices, axis=1), top_scores, err_msg=name)
+
+
+def test_quantized_top_k_reranks_candidates_with_float_embeddings():
+    rng = np.random.default_rng(0)
+    corpus = _normalized(rng, 2000, 32)
+    queries = _normalized(rng, 20, 32)
+    codes, scales = quantize_int8(corpus)
+
+    indices, scores = quantized_top_k(queries, codes, scales, k=3, rerank_embeddings=corpus, n_candidates=50, memory_budget=10_000)
+    np.testing.assert_allclose(scores, np.take_along_axis(queries @ corpus.T, indices, axis=1), rtol=1e-5)
+    assert (np.diff(scores, axis=1) <= 0).all()
@@ -0,0 +1,119 @@
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+# プロジェクトルートをパスに追加してモジュールをインポートできるようにする
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from twitter_api.rate_limit import RateLimitScheduler
+from twitter_api.twitter_api import TwitterAPI, _format_time, _parse_time
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+class _Response:
+    def __init__(self, payload):
+        self.status_code = 200
+        self.headers = {}
+        self._payload = payload
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return self._payload
+
+
+class _SearchSession:
+    """created_atの新しい順に, start_time <= created_at < end_time のツイートをページに分けて返すセッション.
+
+    2件ずつ同じ秒に投稿されたツイートを持つため, ページの境界が同じ秒の途中に来ることがある.
+    """
+
+    def __init__(self, n_tweets: int, interval_seconds: int, latency: float = 0.0):
+        self.tweets = [
+            {"id": str(i), "created_at": _format_time(START + datetime.timedelta(seconds=i // 2 * interval_seconds))}
+            for i in range(n_tweets)
+        ]
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, auth=None, params=None):
+        time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+        start = _parse_time(params["start_time"]) if "start_time" in params else None
+        end = _parse_time(params["end_time"]) if "end_time" in params else None
+        matched = [
+            tweet for tweet in reversed(self.tweets)
+            if (start is None or _parse_time(tweet["created_at"]) >= start)
+            and (end is None or _parse_time(tweet["created_at"]) < end)
+        ]
+        offset = int(params.get("next_token") or params.get("pagination_token") or 0)
+        size = int(params.get("max_results", 10))
+        data = matched[offset:offset + size]
+        payload = {"meta": {"result_count": len(data)}}
+        if data:
+            payload["data"] = data
+        if offset + size < len(matched):
+            payload["meta"]["next_token"] = str(offset + size)
+        return _Response(payload)
+
+    def close(self):
+        pass
+
+
+def _api(session) -> TwitterAPI:
+    api = TwitterAPI("test", "test", rate_limiter=RateLimitScheduler(min_intervals={}, margin=0.0))
+    api.session = session
+    return api
+
+
+def test_crawl_splits_windows_and_removes_boundary_duplicates():
+    session = _SearchSession(n_tweets=1000, interval_seconds=60)
+    end = START + datetime.timedelta(seconds=500 * 60)
+
+    pages = list(_api(session).crawl_tweets_from_query(
+        "query", START, end, n_windows=3, max_workers=3, split_after_pages=2, min_window_seconds=120, max_results=7,
+    ))
+
+    tweets = [tweet for page in pages for tweet in page["response"].get("data", [])]
+    ids = [tweet["id"] for tweet in tweets]
+    assert sorted(ids, key=int) == [tweet["id"] for tweet in session.tweets]
+    times = [_parse_time(tweet["created_at"]) for tweet in tweets]
+    assert times == sorted(times, reverse=True)
+    # 分割しなければ1000 / 7ページと窓の数だけのリクエストになる
+    assert session.requests > 1000 // 7 + 3
+
+
+def test_closing_crawl_stops_fetching():
+    session = _SearchSession(n_tweets=2000, interval_seconds=60, latency=0.01)
+    end = START + datetime.timedelta(seconds=1000 * 60)
+
+    crawl = _api(session).crawl_tweets_from_query("query", START, end, n_windows=8, max_workers=4, max_results=10)
+    next(crawl)
+    requests = session.requests
+    crawl.close()
+
+    # 閉じた後は, 取得中の窓がそれぞれ高々1ページ取得して止まる
+    assert session.requests - requests <= 4
+    stopped = session.requests
+    time.sleep(0.1)
+    assert session.requests == stopped
+
+
+def test_closing_bulk_fetch_stops_fetching():
+    session = _SearchSession(n_tweets=500, interval_seconds=60, latency=0.01)
+
+    results = _api(session).iter_bulk_retweet_users((str(i) for i in range(100)), max_workers=4, max_results=10)
+    next(results)
+    requests = session.requests
+    results.close()
+
+    # 閉じた後は, 取得中のIDがそれぞれ高々1ページ取得して止まり, 待機中のIDは取得しない
+    assert session.requests - requests <= 4
+    stopped = session.requests
+    time.sleep(0.1)
+    assert session.requests == stopped
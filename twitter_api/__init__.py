@@ -1 +1,5 @@
 from . import twitter_api
+from .archive import ArchiveWriter, iter_archive
+from .normalize import TweetNormalizer
+from .rate_limit import RateLimitScheduler
+from .response_cache import ResponseCache
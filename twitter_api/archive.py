@@ -0,0 +1,188 @@
+import glob
+import gzip
+import io
+import json
+import os
+from typing import Iterator, Literal
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+_EXTENSIONS = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+# 途切れたファイルを読んだ場合の例外（gzip.BadGzipFileはOSErrorに含まれる）
+_READ_ERRORS = (EOFError, OSError) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+
+class ArchiveWriter:
+    """取得したページを届いた順に圧縮JSONLファイルへ追記し, クエリごとのページネーションの位置を記録する.
+
+    ファイルは非圧縮で max_bytes_per_file を超えるごとに `{prefix}-{連番}.jsonl.gz` のように切り替える.
+    ページを書き込んでフラッシュした後にチェックポイントを更新するため, 途中で落ちても
+    チェックポイントより前のページは必ずファイルに残っている（最後の1ページは重複する場合がある）.
+    チェックポイントは変わったキーの1行だけを `{prefix}.checkpoint.jsonl` に追記し, 開くときにキーごとの最新の1行にまとめ直す.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        prefix: str = "crawl",
+        compression: Literal["gzip", "zstd"] = "gzip",
+        max_bytes_per_file: int = 256 * 1024 * 1024,
+    ):
+        """
+        Args:
+            directory (str): 保存先のディレクトリ
+            prefix (str): ファイル名の接頭辞
+            compression (str): "gzip" または "zstd"（zstandardパッケージが必要）
+            max_bytes_per_file (int): 1ファイルあたりの非圧縮のバイト数の上限
+        """
+        if compression not in _EXTENSIONS:
+            raise ValueError(f"Unsupported compression: {compression}")
+        if compression == "zstd" and zstandard is None:
+            raise ImportError("zstandard is required for compression='zstd'")
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.max_bytes_per_file = max_bytes_per_file
+        self.checkpoint_path = os.path.join(directory, f"{prefix}.checkpoint.jsonl")
+        os.makedirs(directory, exist_ok=True)
+
+        # 再開時は既存のファイルに追記せず, 次の連番から書き始める
+        self._index = len(_archive_files(directory, prefix))
+        self._file = None
+        self._raw = None
+        self._written = 0
+        self._checkpoints = _load_checkpoints(self.checkpoint_path)
+        # 以前の形式（全キーを1つのJSONに書いたファイル）があれば読み込み, 新しい形式に移す
+        legacy_path = os.path.join(directory, f"{prefix}.checkpoint.json")
+        if os.path.exists(legacy_path):
+            with open(legacy_path) as f:
+                self._checkpoints = {**json.load(f), **self._checkpoints}
+        self._compact_checkpoints()
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+        self._checkpoint_file = open(self.checkpoint_path, "a", encoding="utf-8")
+
+    @staticmethod
+    def checkpoint_key(method: str, params: dict) -> str:
+        """メソッド名とページネーション用トークンを除いたパラメータから, チェックポイントのキーを作る."""
+        params = {k: v for k, v in params.items() if k not in ("next_token", "pagination_token")}
+        return json.dumps([method, params], sort_keys=True, ensure_ascii=False, default=str)
+
+    def checkpoint(self, key: str) -> dict | None:
+        """keyについて記録された {"next_token": ..., "done": ...} を返す. 記録がない場合はNone."""
+        return self._checkpoints.get(key)
+
+    def _compact_checkpoints(self):
+        """キーごとの最新の状態だけを書いたファイルに置き換える. 書き込み途中で落ちても壊れないように置き換えで更新する."""
+        with open(self.checkpoint_path + ".tmp", "w", encoding="utf-8") as f:
+            for key, state in self._checkpoints.items():
+                f.write(json.dumps([key, state], ensure_ascii=False) + "\n")
+        os.replace(self.checkpoint_path + ".tmp", self.checkpoint_path)
+
+    def _open_next(self):
+        self._close_file()
+        path = os.path.join(self.directory, f"{self.prefix}-{self._index:05d}{_EXTENSIONS[self.compression]}")
+        self._index += 1
+        self._written = 0
+        if self.compression == "gzip":
+            self._file = gzip.open(path, "wb")
+        else:
+            self._raw = open(path, "wb")
+            self._file = zstandard.ZstdCompressor().stream_writer(self._raw)
+
+    def _flush(self):
+        if self.compression == "gzip":
+            self._file.flush()
+        else:
+            self._file.flush(zstandard.FLUSH_BLOCK)
+            self._raw.flush()
+
+    def write(self, page: dict, key: str | None = None):
+        """ページを1行追記する. keyを指定した場合はそのページのnext_tokenをチェックポイントに記録する."""
+        line = (json.dumps(page, ensure_ascii=False) + "\n").encode("utf-8")
+        if self._file is None or (self._written > 0 and self._written + len(line) > self.max_bytes_per_file):
+            self._open_next()
+        self._file.write(line)
+        self._written += len(line)
+        self._flush()
+        if key is not None:
+            response = page["response"] if isinstance(page.get("response"), dict) else {}
+            next_token = response.get("meta", {}).get("next_token")
+            state = {"next_token": next_token, "done": next_token is None}
+            self._checkpoints[key] = state
+            # 全キーを書き直さず, 変わったキーの1行だけを追記する
+            self._checkpoint_file.write(json.dumps([key, state], ensure_ascii=False) + "\n")
+            self._checkpoint_file.flush()
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if self._raw is not None:
+            self._raw.close()
+            self._raw = None
+
+    def close(self):
+        self._close_file()
+        if not self._checkpoint_file.closed:
+            self._checkpoint_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def _load_checkpoints(path: str) -> dict:
+    """追記形式のチェックポイントを読み, キーごとに最後の状態を返す. 書き込み途中で途切れた末尾の行は無視する."""
+    checkpoints = {}
+    if not os.path.exists(path):
+        return checkpoints
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            key, state = json.loads(line)
+            checkpoints[key] = state
+    return checkpoints
+
+
+def _archive_files(directory: str, prefix: str = "crawl") -> list[str]:
+    files = []
+    for extension in _EXTENSIONS.values():
+        files.extend(glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(prefix)}-*{extension}")))
+    return sorted(files)
+
+
+def _open_lines(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    if zstandard is None:
+        raise ImportError("zstandard is required to read .zst archives")
+    return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True))
+
+
+def iter_archive(directory: str, prefix: str = "crawl") -> Iterator[dict]:
+    """ArchiveWriterが書き込んだページを, 書き込んだ順に1ページずつ読み出す.
+
+    クラッシュなどで末尾が途切れたファイルは, 読めたところまでを返す.
+
+    Args:
+        directory (str): 保存先のディレクトリ
+        prefix (str): ファイル名の接頭辞
+    Yields:
+        dict: 各ページ
+    """
+    for path in _archive_files(directory, prefix):
+        with _open_lines(path) as f:
+            try:
+                for line in f:
+                    if line.endswith(b"\n"):
+                        yield json.loads(line)
+            except _READ_ERRORS as e:
+                print(f"[WARN] Archive {path} is truncated: {e}")
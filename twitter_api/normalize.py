@@ -0,0 +1,237 @@
+import datetime
+import os
+import uuid
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+def _timestamp():
+    return pa.timestamp("ms", tz="UTC")
+
+
+def _schemas() -> dict:
+    """テーブルごとの列の型. ページによって型が変わらないように明示する."""
+    return {
+        "tweets": pa.schema([
+            ("id", pa.string()),
+            ("author_id", pa.string()),
+            ("conversation_id", pa.string()),
+            ("in_reply_to_user_id", pa.string()),
+            ("created_at", _timestamp()),
+            ("lang", pa.string()),
+            ("text", pa.string()),
+            ("source", pa.string()),
+            ("possibly_sensitive", pa.bool_()),
+            ("created_date", pa.string()),
+        ]),
+        "public_metrics": pa.schema([
+            ("id", pa.string()),
+            ("retweet_count", pa.int64()),
+            ("reply_count", pa.int64()),
+            ("like_count", pa.int64()),
+            ("quote_count", pa.int64()),
+            ("bookmark_count", pa.int64()),
+            ("impression_count", pa.int64()),
+        ]),
+        "users": pa.schema([
+            ("id", pa.string()),
+            ("username", pa.string()),
+            ("name", pa.string()),
+            ("created_at", _timestamp()),
+            ("description", pa.string()),
+            ("location", pa.string()),
+            ("protected", pa.bool_()),
+            ("verified", pa.bool_()),
+            ("followers_count", pa.int64()),
+            ("following_count", pa.int64()),
+            ("tweet_count", pa.int64()),
+            ("listed_count", pa.int64()),
+        ]),
+        "media": pa.schema([
+            ("media_key", pa.string()),
+            ("type", pa.string()),
+            ("url", pa.string()),
+            ("preview_image_url", pa.string()),
+            ("width", pa.int64()),
+            ("height", pa.int64()),
+            ("duration_ms", pa.int64()),
+            ("alt_text", pa.string()),
+        ]),
+        "references": pa.schema([
+            ("tweet_id", pa.string()),
+            ("type", pa.string()),
+            ("referenced_tweet_id", pa.string()),
+        ]),
+    }
+
+
+# テーブルごとの重複判定に使う列
+_KEYS = {
+    "tweets": ("id",),
+    "public_metrics": ("id",),
+    "users": ("id",),
+    "media": ("media_key",),
+    "references": ("tweet_id", "type", "referenced_tweet_id"),
+}
+
+# Hiveパーティションの列. ツイートは作成日ごとに分ける
+_PARTITIONS = {"tweets": ["created_date"]}
+
+
+def _parse_time(value: str | None) -> datetime.datetime | None:
+    if value is None:
+        return None
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+class TweetNormalizer:
+    """APIのレスポンスのページを, ツイート・ユーザ・メディア・参照・public_metricsの列指向テーブルに変換する.
+
+    ページを追加するごとに行をIDで重複排除して列ごとのバッファに貯め, flushでParquetに追記する.
+    重複排除は同じインスタンスに追加したページの間で行う. 書き込みにはpyarrowが必要.
+
+    Example:
+        normalizer = TweetNormalizer("parquet_dir")
+        for page in iter_archive("archive_dir"):
+            normalizer.add_page(page)
+        normalizer.flush()
+    """
+
+    def __init__(self, directory: str | None = None, flush_rows: int = 100_000):
+        """
+        Args:
+            directory (str | None): Parquetの出力先. Noneの場合はto_tablesでのみ取り出す
+            flush_rows (int): バッファの行数がこれを超えたら自動でflushする（directory指定時のみ）
+        """
+        self.directory = directory
+        self.flush_rows = flush_rows
+        self._columns = {table: {} for table in _KEYS}
+        self._n_rows = {table: 0 for table in _KEYS}
+        self._seen = {table: set() for table in _KEYS}
+
+    def _append(self, table: str, row: dict):
+        key = tuple(row[column] for column in _KEYS[table])
+        if key in self._seen[table]:
+            return
+        self._seen[table].add(key)
+        columns = self._columns[table]
+        n = self._n_rows[table]
+        for column, value in row.items():
+            # 途中から現れた列は, それまでの行をNoneで埋める
+            columns.setdefault(column, [None] * n).append(value)
+        self._n_rows[table] = n + 1
+
+    def _add_tweet(self, tweet: dict):
+        created_at = _parse_time(tweet.get("created_at"))
+        self._append("tweets", {
+            "id": tweet["id"],
+            "author_id": tweet.get("author_id"),
+            "conversation_id": tweet.get("conversation_id"),
+            "in_reply_to_user_id": tweet.get("in_reply_to_user_id"),
+            "created_at": created_at,
+            "lang": tweet.get("lang"),
+            "text": tweet.get("text"),
+            "source": tweet.get("source"),
+            "possibly_sensitive": tweet.get("possibly_sensitive"),
+            "created_date": created_at.strftime("%Y-%m-%d") if created_at else "unknown",
+        })
+        if "public_metrics" in tweet:
+            metrics = tweet["public_metrics"]
+            self._append("public_metrics", {
+                "id": tweet["id"],
+                **{name: metrics.get(name) for name in (
+                    "retweet_count", "reply_count", "like_count", "quote_count", "bookmark_count", "impression_count"
+                )},
+            })
+        for reference in tweet.get("referenced_tweets", []):
+            self._append("references", {
+                "tweet_id": tweet["id"],
+                "type": reference.get("type"),
+                "referenced_tweet_id": reference.get("id"),
+            })
+
+    def _add_user(self, user: dict):
+        metrics = user.get("public_metrics", {})
+        self._append("users", {
+            "id": user["id"],
+            "username": user.get("username"),
+            "name": user.get("name"),
+            "created_at": _parse_time(user.get("created_at")),
+            "description": user.get("description"),
+            "location": user.get("location"),
+            "protected": user.get("protected"),
+            "verified": user.get("verified"),
+            **{name: metrics.get(name) for name in ("followers_count", "following_count", "tweet_count", "listed_count")},
+        })
+
+    def _add_media(self, media: dict):
+        self._append("media", {
+            "media_key": media["media_key"],
+            "type": media.get("type"),
+            "url": media.get("url"),
+            "preview_image_url": media.get("preview_image_url"),
+            "width": media.get("width"),
+            "height": media.get("height"),
+            "duration_ms": media.get("duration_ms"),
+            "alt_text": media.get("alt_text"),
+        })
+
+    def add_page(self, page: dict):
+        """_log_generatorの結果（またはそのresponse部分）を1ページ分追加する."""
+        response = page.get("response", page)
+        if not isinstance(response, dict):
+            return
+        for item in response.get("data", []):
+            # retweeted_byのページはユーザ, それ以外はツイートが入っている
+            if "username" in item:
+                self._add_user(item)
+            else:
+                self._add_tweet(item)
+        includes = response.get("includes", {})
+        for tweet in includes.get("tweets", []):
+            self._add_tweet(tweet)
+        for user in includes.get("users", []):
+            self._add_user(user)
+        for media in includes.get("media", []):
+            self._add_media(media)
+        if self.directory is not None and sum(self._n_rows.values()) >= self.flush_rows:
+            self.flush()
+
+    def to_tables(self) -> dict:
+        """バッファに貯まっている行をpyarrow.Tableに変換する（バッファは消さない）."""
+        if pa is None:
+            raise ImportError("pyarrow is required to build tables")
+        tables = {}
+        for table, schema in _schemas().items():
+            n = self._n_rows[table]
+            columns = self._columns[table]
+            tables[table] = pa.table(
+                {field.name: pa.array(columns.get(field.name, [None] * n), type=field.type) for field in schema},
+                schema=schema,
+            )
+        return tables
+
+    def flush(self):
+        """バッファの行を `directory/テーブル名/` 以下のParquetファイルに追記し, バッファを空にする."""
+        if self.directory is None:
+            raise ValueError("directory is required to flush")
+        if pq is None:
+            raise ImportError("pyarrow is required to write Parquet files")
+        # 以前の実行で書いたファイルを上書きしないよう, flushごとに一意なファイル名にする
+        basename = f"part-{uuid.uuid4().hex}-{{i}}.parquet"
+        for table, data in self.to_tables().items():
+            if data.num_rows == 0:
+                continue
+            pq.write_to_dataset(
+                data,
+                root_path=os.path.join(self.directory, table),
+                partition_cols=_PARTITIONS.get(table),
+                basename_template=basename,
+            )
+        self._columns = {table: {} for table in _KEYS}
+        self._n_rows = {table: 0 for table in _KEYS}
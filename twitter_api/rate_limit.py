@@ -0,0 +1,85 @@
+import threading
+import time
+
+
+class RateLimitScheduler:
+    """x-rate-limit-* ヘッダからエンドポイントごとの残り回数を管理し, リクエストの間隔を調整する.
+
+    残り回数をリセットまでの時間に均等に割り振って送信するため, ウィンドウを使い切りつつ429を起こさない.
+    残り回数が0の場合はリセット時刻まで待つ. スレッドセーフで, 複数のワーカーから共有できる.
+    """
+
+    # 429にリセット時刻が含まれていない場合の待機秒数
+    DEFAULT_RESET_WAIT = 60.0
+
+    def __init__(self, min_intervals: dict[str, float] | None = None, margin: float = 1.0):
+        """
+        Args:
+            min_intervals (dict[str, float] | None): エンドポイントごとの最小送信間隔(秒).
+                Noneの場合は全期間検索の1リクエスト/秒の制限だけを設定する
+            margin (float): 時計のずれに備えてリセット時刻に加える秒数
+        """
+        self.min_intervals = {"/tweets/search/all": 1.0} if min_intervals is None else min_intervals
+        self.margin = margin
+        self.total_wait = 0.0
+        self._lock = threading.Lock()
+        self._limits = {}
+        self._next_slot = {}
+
+    def acquire(self, endpoint: str) -> float:
+        """endpointにリクエストを送ってよい時刻まで待ち, 残り回数を1つ予約する.
+
+        Returns:
+            float: 待機した秒数
+        """
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot.get(endpoint, 0.0))
+            interval = self.min_intervals.get(endpoint, 0.0)
+            state = self._limits.get(endpoint)
+            if state is not None and slot < state["reset"]:
+                if state["remaining"] > 0:
+                    interval = max(interval, (state["reset"] - slot) / state["remaining"])
+                    state["remaining"] -= 1
+                else:
+                    # ウィンドウを使い切っているのでリセットまで待ち, 以降は次のレスポンスのヘッダに従う
+                    slot = state["reset"] + self.margin
+                    del self._limits[endpoint]
+            self._next_slot[endpoint] = slot + interval
+            wait = slot - now
+            self.total_wait += wait
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def update(self, endpoint: str, response):
+        """レスポンスのヘッダからendpointの残り回数とリセット時刻を更新する."""
+        headers = response.headers
+        with self._lock:
+            if response.status_code == 429:
+                reset = headers.get("x-rate-limit-reset")
+                self._limits[endpoint] = {
+                    "limit": int(headers.get("x-rate-limit-limit", 0)),
+                    "remaining": 0,
+                    "reset": float(reset) if reset is not None else time.time() + self.DEFAULT_RESET_WAIT,
+                }
+            elif "x-rate-limit-remaining" in headers and "x-rate-limit-reset" in headers:
+                self._limits[endpoint] = {
+                    "limit": int(headers.get("x-rate-limit-limit", 0)),
+                    "remaining": int(headers["x-rate-limit-remaining"]),
+                    "reset": float(headers["x-rate-limit-reset"]),
+                }
+
+    def budget(self, endpoint: str) -> dict | None:
+        """endpointの現在の上限・残り回数・リセットまでの秒数を返す. まだ情報がない場合はNone."""
+        with self._lock:
+            state = self._limits.get(endpoint)
+            if state is None:
+                return None
+            return {**state, "seconds_to_reset": max(0.0, state["reset"] - time.time())}
+
+    def budgets(self) -> dict[str, dict]:
+        """全エンドポイントの現在の予算を返す."""
+        with self._lock:
+            endpoints = list(self._limits)
+        return {endpoint: self.budget(endpoint) for endpoint in endpoints}
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Literal
+
+
+class CachedResponse:
+    """キャッシュから復元したレスポンス. requests.Responseのうち, TwitterAPIが使う属性だけを持つ."""
+
+    def __init__(self, status_code: int, text: str, headers: dict):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ResponseCache:
+    """エンドポイントと正規化したパラメータをキーとして, APIのレスポンスをSQLiteに保存するキャッシュ.
+
+    mode:
+        - "record": キャッシュにあれば使い, なければAPIを呼んで保存する
+        - "replay": キャッシュだけを使う（オフライン）. ないものはLookupErrorになり, ttlは無視する
+        - "refresh": 常にAPIを呼び, キャッシュを上書きする
+    """
+
+    def __init__(
+        self,
+        path: str = "twitter_cache.sqlite3",
+        mode: Literal["record", "replay", "refresh"] = "record",
+        ttl: float | None = None,
+        max_bytes: int | None = None,
+    ):
+        """
+        Args:
+            path (str): SQLiteファイルのパス
+            mode (str): "record", "replay", "refresh" のいずれか
+            ttl (float | None): キャッシュの有効期間(秒). Noneの場合は無期限
+            max_bytes (int | None): 保存するレスポンスの合計バイト数の上限. Noneの場合は無制限
+        """
+        if mode not in ("record", "replay", "refresh"):
+            raise ValueError(f"Unsupported mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status_code INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body TEXT NOT NULL,
+                nbytes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def _canonical_params(params: dict) -> str:
+        return json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+
+    @classmethod
+    def key(cls, url: str, params: dict) -> str:
+        """URLと正規化したパラメータからキャッシュキーを求める."""
+        return hashlib.sha256(f"{url}\n{cls._canonical_params(params)}".encode("utf-8")).hexdigest()
+
+    def get(self, url: str, params: dict) -> CachedResponse | None:
+        """キャッシュされたレスポンスを返す. modeが"refresh"の場合や, 期限切れ・未保存の場合はNone.
+
+        Raises:
+            LookupError: modeが"replay"でキャッシュにない場合
+        """
+        if self.mode == "refresh":
+            return None
+        key = self.key(url, params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status_code, headers, body, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            now = time.time()
+            expired = row is not None and self.mode != "replay" and self.ttl is not None and now - row[3] > self.ttl
+            if row is None or expired:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+        if row is None or expired:
+            if self.mode == "replay":
+                raise LookupError(f"No cached response for {url} {self._canonical_params(params)}")
+            return None
+        status_code, headers, body, _ = row
+        return CachedResponse(status_code, body, json.loads(headers))
+
+    def put(self, url: str, params: dict, response):
+        """レスポンスを保存する. modeが"replay"の場合は何もしない."""
+        if self.mode == "replay":
+            return
+        body = response.text
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, url, params, status_code, headers, body, nbytes, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.key(url, params),
+                    url,
+                    self._canonical_params(params),
+                    response.status_code,
+                    json.dumps(dict(response.headers)),
+                    body,
+                    len(body.encode("utf-8")),
+                    now,
+                    now,
+                ),
+            )
+            if self.max_bytes is not None:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """合計サイズがmax_bytesを超えている場合, 最終アクセスが古いものから削除する."""
+        total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM responses").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        victims = []
+        freed = 0
+        for key, nbytes in self._conn.execute("SELECT key, nbytes FROM responses ORDER BY last_access"):
+            if freed >= excess:
+                break
+            victims.append((key,))
+            freed += nbytes
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+
+    def stats(self) -> dict:
+        """ヒット数・ミス数・保存件数・合計バイト数を返す."""
+        with self._lock:
+            entries, nbytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM responses"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": nbytes,
+        }
+
+    def clear(self):
+        """保存されているレスポンスとカウンタをすべて削除する."""
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,14 +1,74 @@
-from typing import Callable, Literal
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, Literal
 import requests
+from requests.adapters import HTTPAdapter
 import datetime
+import threading
 import time
 
+from .archive import ArchiveWriter
+from .rate_limit import RateLimitScheduler
+from .response_cache import ResponseCache
+
+
+def _parse_time(value: str | datetime.datetime) -> datetime.datetime:
+    """APIの日時文字列（例: "2023-01-01T00:00:00Z"）をUTCのdatetimeに変換する."""
+    if isinstance(value, datetime.datetime):
+        return value if value.tzinfo else value.replace(tzinfo=datetime.timezone.utc)
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _format_time(value: datetime.datetime) -> str:
+    return value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
 
 class TwitterAPI:
-    def __init__(self, bearer_token, username):
+    def __init__(
+        self,
+        bearer_token,
+        username,
+        pool_size: int = 10,
+        rate_limiter: RateLimitScheduler | None = None,
+        response_cache: ResponseCache | None = None,
+        hooks: Callable | None = None,
+    ):
+        """
+        Args:
+            bearer_token (str): Bearer Token
+            username (str): User-Agentに使うユーザ名
+            pool_size (int): 使い回すHTTPコネクションの最大数
+            rate_limiter (RateLimitScheduler | None): レート制限のスケジューラ. Noneの場合は新しく作る
+            response_cache (ResponseCache | None): レスポンスのキャッシュ. 指定した場合は同じリクエストをAPIに送らない
+            hooks (Callable | None): 計測用のフック. hooks(event, **fields) の形で, リクエストごとのレイテンシ・件数・バイト数,
+                レート制限の待ち時間, キャッシュのヒット数を受け取る（utils.instrumentation.MetricsCollectorなど）.
+                Noneの場合は計測しない
+        """
         self.bearer_token = bearer_token
         self.username = username
         self.base_url = "https://api.twitter.com/2"
+        # 呼び出しごとにTCP/TLS接続を張り直さないよう, keep-aliveのセッションを使い回す
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimitScheduler()
+        self.response_cache = response_cache
+        self.hooks = hooks
+
+    def rate_limit_budgets(self) -> dict[str, dict]:
+        """エンドポイントごとの現在のレート制限の予算(上限・残り回数・リセットまでの秒数)を返す."""
+        return self.rate_limiter.budgets()
+
+    def close(self):
+        """セッションのコネクションを閉じる."""
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
 
     def _bearer_oauth(self, r):
         """
@@ -52,11 +112,12 @@ class TwitterAPI:
         else:
             raise ValueError(f"Unsupported method: {method}")
 
-    def _log_generator(self, response, params) -> dict:
+    def _log_generator(self, response, params, body: dict | None = None) -> dict:
         """APIをいつどのようなパラメータで呼び出したのか必ず記録するための関数.
         Args:
             response (requests.Response): APIのレスポンスオブジェクト
             params (dict): API呼び出し時のパラメータ
+            body (dict | None): パース済みのレスポンス. Noneの場合はresponseからパースする
         Returns:
             dict: レスポンス内容とパラメータを含む辞書
         """
@@ -67,10 +128,63 @@ class TwitterAPI:
                 "params": params,
             },
             "response": (
-                response.json() if response.status_code == 200 else response.text
+                (body if body is not None else response.json()) if response.status_code == 200 else response.text
             ),
         }
 
+    def _get(self, endpoint: str, url: str, params: dict, max_rate_limit_retries: int = 3) -> tuple[requests.Response, dict]:
+        """レート制限に従ってGETリクエストを送る. 429の場合はリセットまで待って再送する.
+        response_cacheがある場合はキャッシュを優先し, 取得したレスポンスを保存する.
+
+        Args:
+            endpoint (str): レート制限を管理するエンドポイント名
+            url (str): リクエスト先のURL
+            params (dict): リクエストパラメータ
+            max_rate_limit_retries (int): 429を受け取った場合の最大再送回数
+        Returns:
+            tuple[requests.Response, dict]: ステータスコード200のレスポンスと, パース済みのレスポンス
+        """
+        if self.response_cache is not None:
+            cached = self.response_cache.get(url, params)
+            if self.hooks is not None:
+                hit = cached is not None
+                self.hooks("cache", component="twitter", endpoint=endpoint, hits=int(hit), misses=int(not hit))
+            if cached is not None:
+                return cached, cached.json()
+        for attempt in range(max_rate_limit_retries + 1):
+            wait = self.rate_limiter.acquire(endpoint)
+            start = time.perf_counter()
+            response = self.session.get(url, auth=self._bearer_oauth, params=params)
+            latency = time.perf_counter() - start
+            self.rate_limiter.update(endpoint, response)
+            # 計測の件数と_log_generatorの両方で使うため, レスポンスは1回だけパースする
+            body = response.json() if response.status_code == 200 else None
+            if self.hooks is not None:
+                self._emit_request(endpoint, response, body, latency, wait, attempt)
+            if response.status_code != 429:
+                break
+            print(f"[WARN] Rate limit exceeded on {endpoint}, waiting until reset")
+        if response.status_code != 200:
+            raise Exception(response.status_code, response.text)
+        if self.response_cache is not None:
+            self.response_cache.put(url, params, response)
+        return response, body
+
+    def _emit_request(self, endpoint: str, response, body: dict | None, latency: float, wait: float, attempt: int):
+        content = getattr(response, "content", None)
+        n_bytes = len(content) if isinstance(content, bytes) else len(response.text.encode("utf-8"))
+        items = 0
+        if body is not None:
+            items = body.get("meta", {}).get("result_count", len(body.get("data", [])))
+        if attempt > 0:
+            self.hooks("retry", component="twitter", endpoint=endpoint, delay=wait, status=429)
+        if wait > 0:
+            self.hooks("rate_limit_wait", component="twitter", endpoint=endpoint, seconds=wait)
+        self.hooks(
+            "request", component="twitter", endpoint=endpoint, latency=latency,
+            items=items, bytes=n_bytes, status=response.status_code,
+        )
+
     def get_tweets_from_query(self, query, **kwargs):
         """queryからツイートを取得する.
 
@@ -93,11 +207,8 @@ class TwitterAPI:
         params["query"] = query
         params.update(kwargs)
 
-        response = requests.get(url, auth=self._bearer_oauth, params=params)
-        # print(response.status_code)
-        if response.status_code != 200:
-            raise Exception(response.status_code, response.text)
-        return self._log_generator(response, params)
+        response, body = self._get("/tweets/search/all", url, params)
+        return self._log_generator(response, params, body)
 
     def get_tweets_from_user_id(self, user_id: str, **kwargs):
         """user_idからツイートを取得する. 取得されるツイートはリツイートを除く.
@@ -133,10 +244,8 @@ class TwitterAPI:
         params = self._get_default_params("/tweets/retweeted_by")
         params.update(kwargs)
 
-        response = requests.get(url, auth=self._bearer_oauth, params=params)
-        if response.status_code != 200:
-            raise Exception(response.status_code, response.text)
-        return self._log_generator(response, params)
+        response, body = self._get("/tweets/retweeted_by", url, params)
+        return self._log_generator(response, params, body)
 
     def get_quote_user_from_tweet_id(self, tweet_id, **kwargs):
         """tweet_idから引用リツイートしたユーザを取得する.
@@ -154,10 +263,274 @@ class TwitterAPI:
         params = self._get_default_params("/tweets/quote_tweets")
         params.update(kwargs)
 
-        response = requests.get(url, auth=self._bearer_oauth, params=params)
-        if response.status_code != 200:
-            raise Exception(response.status_code, response.text)
-        return self._log_generator(response, params)
+        response, body = self._get("/tweets/quote_tweets", url, params)
+        return self._log_generator(response, params, body)
+
+    def _iter_pages(
+        self,
+        fetch: Callable[..., dict],
+        token_param: str,
+        max_total_results: int | None = None,
+        time_limit: float | None = None,
+        **kwargs,
+    ) -> Iterator[dict]:
+        """meta.next_token をたどって次のページを取得し, ページごとに返す.
+
+        Args:
+            fetch (Callable): 1ページ分を取得する関数
+            token_param (str): 次のページを指定するパラメータ名
+            max_total_results (int | None): 取得する件数の合計の上限
+            time_limit (float | None): 取得を続ける秒数の上限
+            kwargs: fetchに渡すパラメータ
+        Yields:
+            dict: 各ページの_log_generatorの結果
+        """
+        deadline = time.monotonic() + time_limit if time_limit is not None else None
+        n_results = 0
+        while True:
+            page = fetch(**kwargs)
+            yield page
+            meta = page["response"].get("meta", {})
+            n_results += meta.get("result_count", len(page["response"].get("data", [])))
+            next_token = meta.get("next_token")
+            if next_token is None:
+                return
+            if max_total_results is not None and n_results >= max_total_results:
+                return
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            kwargs[token_param] = next_token
+
+    def iter_tweets_from_query(self, query, max_total_results: int | None = None, time_limit: float | None = None, **kwargs) -> Iterator[dict]:
+        """get_tweets_from_queryのページネーションを自動でたどり, ページごとに返す.
+
+        Args:
+            query (str): 取得したい検索クエリ
+            max_total_results (int | None): 取得するツイート数の合計の上限. 上限を超えたページで止まる
+            time_limit (float | None): 取得を続ける秒数の上限
+            kwargs: get_tweets_from_queryに渡すパラメータ
+        Yields:
+            dict: 各ページの取得結果
+        """
+        return self._iter_pages(
+            self.get_tweets_from_query, "next_token", max_total_results, time_limit, query=query, **kwargs
+        )
+
+    def crawl_tweets_from_query(
+        self,
+        query,
+        start_time: str | datetime.datetime,
+        end_time: str | datetime.datetime,
+        n_windows: int = 8,
+        max_workers: int = 4,
+        split_after_pages: int = 10,
+        min_window_seconds: float = 60,
+        **kwargs,
+    ) -> Iterator[dict]:
+        """start_time〜end_timeを時間窓に分割し, 窓ごとのページネーションを並行して行う.
+
+        split_after_pages ページを取得してもまだ続きがある窓は, 残りの期間を2つに分割して並行して取得する.
+        結果はAPIと同じく新しい順に1つのストリームとして返し, 窓の境界で重複したツイートはIDで取り除く.
+        出力順を保つため取得済みの窓は出力するまでメモリに保持するが, 先読みする窓は出力待ちの先頭からmax_workers個までに
+        抑えるため, 保持するページはおよそ max_workers * split_after_pages ページに収まる.
+        ジェネレータを閉じた場合や取得中に例外が起きた場合は, 取得中の窓も次のページの前で止める.
+
+        Args:
+            query (str): 取得したい検索クエリ
+            start_time (str | datetime): 取得するツイートの開始日時（例: "2023-01-01T00:00:00Z"）
+            end_time (str | datetime): 取得するツイートの終了日時（例: "2023-01-31T23:59:59Z"）
+            n_windows (int): 最初に分割する窓の数
+            max_workers (int): 同時に取得する窓の数
+            split_after_pages (int): 窓を分割するまでに取得するページ数
+            min_window_seconds (float): 分割後の窓の最小の長さ(秒). これより短くなる場合は分割せずに取得を続ける
+            kwargs: get_tweets_from_queryに渡すパラメータ
+        Yields:
+            dict: 各ページの取得結果. response["data"]からは重複したツイートが除かれている
+        """
+        start = _parse_time(start_time)
+        end = _parse_time(end_time)
+        step = (end - start) / n_windows
+        bounds = [start + step * i for i in range(n_windows)] + [end]
+        min_window = datetime.timedelta(seconds=min_window_seconds)
+        stop = threading.Event()
+
+        def crawl_window(window_start, window_end):
+            """窓を取得し, (ページのリスト, 残りの期間を分割した窓のリスト) を返す."""
+            pages = []
+            for page in self.iter_tweets_from_query(
+                query, start_time=_format_time(window_start), end_time=_format_time(window_end), **kwargs
+            ):
+                pages.append(page)
+                response = page["response"]
+                if stop.is_set():
+                    break
+                if len(pages) < split_after_pages or not response.get("meta", {}).get("next_token"):
+                    continue
+                # 取得済みの最も古いツイートより前の期間を2つに分割する. 同じ秒のツイートを落とさないよう1秒重ねる
+                oldest = min(_parse_time(tweet["created_at"]) for tweet in response["data"])
+                rest_end = min(window_end, oldest + datetime.timedelta(seconds=1))
+                if rest_end - window_start >= 2 * min_window:
+                    middle = window_start + (rest_end - window_start) / 2
+                    return pages, [(middle, rest_end), (window_start, middle)]
+            return pages, []
+
+        # 出力順（新しい順）に並べた窓. 先頭のmax_workers個だけを投入したFutureにしておく
+        windows = deque((bounds[i], bounds[i + 1]) for i in reversed(range(n_windows)))
+        # 重複は隣接する窓の境界でしか起きないため, 直前の2ページ分のIDだけを覚えておく
+        recent_ids = deque(maxlen=2)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            while windows:
+                for i in range(min(max_workers, len(windows))):
+                    if not isinstance(windows[i], Future):
+                        windows[i] = executor.submit(crawl_window, *windows[i])
+                pages, children = windows.popleft().result()
+                # 分割した窓は親の窓の続きなので, 残りの窓より先に出力する
+                windows.extendleft(reversed(children))
+                for page in pages:
+                    response = page["response"]
+                    if "data" in response:
+                        data = response["data"]
+                        response["data"] = [
+                            tweet for tweet in data if not any(tweet["id"] in ids for ids in recent_ids)
+                        ]
+                        recent_ids.append({tweet["id"] for tweet in data})
+                    yield page
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def iter_retweet_users(self, tweet_id, max_total_results: int | None = None, time_limit: float | None = None, **kwargs) -> Iterator[dict]:
+        """get_retweet_user_from_tweet_idのページネーションを自動でたどり, ページごとに返す.
+
+        Args:
+            tweet_id (str): 取得したいツイートのID
+            max_total_results (int | None): 取得するユーザ数の合計の上限. 上限を超えたページで止まる
+            time_limit (float | None): 取得を続ける秒数の上限
+            kwargs: get_retweet_user_from_tweet_idに渡すパラメータ
+        Yields:
+            dict: 各ページの取得結果
+        """
+        return self._iter_pages(
+            self.get_retweet_user_from_tweet_id, "pagination_token", max_total_results, time_limit, tweet_id=tweet_id, **kwargs
+        )
+
+    def iter_quote_tweets(self, tweet_id, max_total_results: int | None = None, time_limit: float | None = None, **kwargs) -> Iterator[dict]:
+        """get_quote_user_from_tweet_idのページネーションを自動でたどり, ページごとに返す.
+
+        Args:
+            tweet_id (str): 取得したいツイートのID
+            max_total_results (int | None): 取得する引用ツイート数の合計の上限. 上限を超えたページで止まる
+            time_limit (float | None): 取得を続ける秒数の上限
+            kwargs: get_quote_user_from_tweet_idに渡すパラメータ
+        Yields:
+            dict: 各ページの取得結果
+        """
+        return self._iter_pages(
+            self.get_quote_user_from_tweet_id, "pagination_token", max_total_results, time_limit, tweet_id=tweet_id, **kwargs
+        )
+
+    def _fan_out(
+        self,
+        iter_pages: Callable[..., Iterator[dict]],
+        tweet_ids: Iterable[str],
+        max_workers: int,
+        **kwargs,
+    ) -> Iterator[tuple[str, list[dict] | None, Exception | None]]:
+        """tweet_idごとに全ページの取得をスレッドプールで並行して行い, 完了した順に返す.
+
+        レート制限はself.rate_limiterを全ワーカーで共有する. 実行中のIDはmax_workersの2倍までに抑え,
+        tweet_idsは必要な分だけ読み進める. ジェネレータを閉じた場合は, 待機中のIDを取り消し, 取得中のIDも次のページの前で止める.
+        """
+        stop = threading.Event()
+
+        def fetch_all(tweet_id):
+            pages = []
+            for page in iter_pages(tweet_id, **kwargs):
+                pages.append(page)
+                # 呼び出し元がジェネレータを閉じた場合は, 次のページを取得せずに止める
+                if stop.is_set():
+                    break
+            return pages
+
+        tweet_ids = iter(tweet_ids)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            pending = {}
+            while True:
+                for tweet_id in tweet_ids:
+                    pending[executor.submit(fetch_all, tweet_id)] = tweet_id
+                    if len(pending) >= max_workers * 2:
+                        break
+                if not pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tweet_id = pending.pop(future)
+                    # 1つのIDの失敗で全体を止めないよう, 例外は結果として返す
+                    error = future.exception()
+                    yield tweet_id, (None if error else future.result()), error
+        finally:
+            stop.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def iter_bulk_retweet_users(self, tweet_ids: Iterable[str], max_workers: int = 8, **kwargs) -> Iterator[tuple[str, list[dict] | None, Exception | None]]:
+        """複数のtweet_idについてリツイートしたユーザを並行して全ページ取得する.
+
+        Args:
+            tweet_ids (Iterable[str]): 取得したいツイートのID
+            max_workers (int): 同時に取得するIDの数. pool_size以下にするとコネクションを使い回せる
+            kwargs: iter_retweet_usersに渡すパラメータ（max_total_resultsなど）
+        Yields:
+            tuple: 完了した順に (tweet_id, ページのリスト, 例外). 成功した場合は例外がNone, 失敗した場合はページのリストがNone
+        """
+        return self._fan_out(self.iter_retweet_users, tweet_ids, max_workers, **kwargs)
+
+    def iter_bulk_quote_tweets(self, tweet_ids: Iterable[str], max_workers: int = 8, **kwargs) -> Iterator[tuple[str, list[dict] | None, Exception | None]]:
+        """複数のtweet_idについて引用ツイートを並行して全ページ取得する.
+
+        Args:
+            tweet_ids (Iterable[str]): 取得したいツイートのID
+            max_workers (int): 同時に取得するIDの数. pool_size以下にするとコネクションを使い回せる
+            kwargs: iter_quote_tweetsに渡すパラメータ（max_total_resultsなど）
+        Yields:
+            tuple: 完了した順に (tweet_id, ページのリスト, 例外). 成功した場合は例外がNone, 失敗した場合はページのリストがNone
+        """
+        return self._fan_out(self.iter_quote_tweets, tweet_ids, max_workers, **kwargs)
+
+    def archive_crawl(
+        self,
+        writer: ArchiveWriter,
+        method: Literal["tweets_from_query", "retweet_users", "quote_tweets"] = "tweets_from_query",
+        **kwargs,
+    ) -> int:
+        """ページネーションをたどりながら各ページをwriterへ追記する. 中断した場合は同じ引数で呼び直すと続きから再開する.
+
+        Args:
+            writer (ArchiveWriter): 書き込み先
+            method (str): 使うiter_*メソッド
+            kwargs: iter_*メソッドに渡すパラメータ（query, tweet_id, max_results など）
+        Returns:
+            int: 今回書き込んだページ数
+        """
+        iter_pages, token_param = {
+            "tweets_from_query": (self.iter_tweets_from_query, "next_token"),
+            "retweet_users": (self.iter_retweet_users, "pagination_token"),
+            "quote_tweets": (self.iter_quote_tweets, "pagination_token"),
+        }[method]
+        key = writer.checkpoint_key(method, kwargs)
+        state = writer.checkpoint(key)
+        if state is not None:
+            if state["done"]:
+                return 0
+            kwargs[token_param] = state["next_token"]
+            print(f"[INFO] Resuming {method} from {token_param}={state['next_token']}")
+
+        n_pages = 0
+        for page in iter_pages(**kwargs):
+            writer.write(page, key)
+            n_pages += 1
+        return n_pages
 
     def error_handled_executor(
         self,
@@ -168,7 +541,8 @@ class TwitterAPI:
         **kwargs,
     ):
         """
-        指定された関数を実行し、例外が発生した場合は複数回実行を行う
+        指定された関数を実行し、例外が発生した場合は複数回実行を行う.
+        レート制限による待機はrate_limiterが行うため, ここでは失敗した後にだけinterval秒待つ.
 
         Args:
             func (function): 実行したい関数
@@ -180,10 +554,18 @@ class TwitterAPI:
             any: 関数の戻り値
         """
         for i in range(max_retries):
-            time.sleep(interval)
+            if i > 0:
+                time.sleep(interval)
             try:
                 return func(*args, **kwargs)
             except Exception as e:
                 print(f"Error: {e}")
+                if self.hooks is not None and i + 1 < max_retries:
+                    # _getの例外は (ステータスコード, 本文) を持つ
+                    status = e.args[0] if e.args and isinstance(e.args[0], int) else None
+                    self.hooks(
+                        "retry", component="twitter", endpoint=getattr(func, "__name__", repr(func)),
+                        delay=interval, status=status,
+                    )
         print("Max retries reached. Giving up.")
         return None
@@ -1,2 +1,3 @@
-from .threading_process import run_in_executor
+from .threading_process import WorkerPool, get_default_pool, run_in_executor
+from .instrumentation import JSONLinesHook, LoggingHook, MetricsCollector, combine_hooks
 # from . import comparison
@@ -1,3 +1,5 @@
 from .cosine_similarity import *
 from .js_divergence import *
-from .entropy import *
\ No newline at end of file
+from .entropy import *
+from .ann_index import *
+from .parallel import *
@@ -0,0 +1,259 @@
+import json
+import os
+
+import numpy as np
+
+from .cosine_similarity import _normalize_rows
+
+
+class IVFIndex:
+    """k-meansの粗い量子化によるIVF(転置ファイル)形式の近似最近傍探索インデックス.
+
+    ベクトルをL2正規化してから扱うため, スコアはコサイン類似度になる.
+    Embedding.dimension_reductionの結果をそのまま追加できる.
+
+    Example:
+        index = IVFIndex(n_lists=256)
+        index.train(embeddings)
+        index.add(embeddings)
+        indices, scores = index.search(queries, k=10)
+    """
+
+    def __init__(self, n_lists: int = 256, n_probe: int = 8, dtype=np.float32, seed: int = 0):
+        """
+        Args:
+            n_lists (int): クラスタ(転置リスト)の数
+            n_probe (int): 検索時に調べるクラスタの数. 大きいほど再現率が上がり遅くなる
+            dtype: ベクトルを保持する型
+            seed (int): k-meansの乱数シード
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.dtype = dtype
+        self.seed = seed
+        self.centroids = None
+        # 保存済み(またはloadした)ベクトルはクラスタ順に並べて保持し, クラスタlの要素は _offsets[l]:_offsets[l + 1] にある.
+        # loadした場合はメモリマップのままにする
+        self._vectors = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._lists = np.empty(0, dtype=np.int64)
+        self._offsets = None
+        # addしたベクトルは (ベクトル, ID, クラスタ) の組として末尾に積み, saveのときに上の配列とまとめる
+        self._tail = []
+        self._sorted_tail = None
+        self._next_id = 0
+
+    def __len__(self) -> int:
+        return len(self._ids) + sum(len(ids) for _, ids, _ in self._tail)
+
+    def _assign(self, normalized: np.ndarray, block: int = 8192) -> np.ndarray:
+        """各ベクトルを最も近いクラスタに割り当てる."""
+        assignments = np.empty(len(normalized), dtype=np.int64)
+        for start in range(0, len(normalized), block):
+            assignments[start:start + block] = np.argmax(normalized[start:start + block] @ self.centroids.T, axis=1)
+        return assignments
+
+    def train(self, embeddings, n_iter: int = 20, max_samples: int | None = None):
+        """球面k-meansでクラスタの中心を学習する.
+
+        Args:
+            embeddings (np.ndarray or pd.DataFrame): 学習に使うベクトル
+            n_iter (int): k-meansの反復回数
+            max_samples (int | None): 学習に使う最大件数. Noneの場合は n_lists * 256 件
+        """
+        rng = np.random.default_rng(self.seed)
+        normalized = _normalize_rows(embeddings, self.dtype)
+        max_samples = max_samples or self.n_lists * 256
+        if len(normalized) > max_samples:
+            normalized = normalized[rng.choice(len(normalized), max_samples, replace=False)]
+        if len(normalized) < self.n_lists:
+            raise ValueError(f"At least n_lists={self.n_lists} vectors are required to train, got {len(normalized)}")
+
+        self.centroids = normalized[rng.choice(len(normalized), self.n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignments = self._assign(normalized)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, normalized)
+            counts = np.bincount(assignments, minlength=self.n_lists)
+            # 空になったクラスタはランダムな点で初期化し直す
+            empty = counts == 0
+            sums[empty] = normalized[rng.choice(len(normalized), empty.sum())]
+            self.centroids = _normalize_rows(sums, self.dtype)
+        return self
+
+    def add(self, embeddings, ids=None):
+        """ベクトルを追加する. trainの後であれば何度でも追加できる.
+
+        Args:
+            embeddings (np.ndarray or pd.DataFrame): 追加するベクトル
+            ids (array-like | None): 検索結果として返すID. Noneの場合は追加した順の通し番号
+        """
+        if self.centroids is None:
+            raise ValueError("train must be called before add")
+        normalized = _normalize_rows(embeddings, self.dtype)
+        if ids is None:
+            ids = np.arange(self._next_id, self._next_id + len(normalized), dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) != len(normalized):
+            raise ValueError(f"ids must have the same length as embeddings: {len(ids)} != {len(normalized)}")
+
+        # 既存のベクトルには触れず, 追加分だけを割り当てて末尾に積む
+        self._tail.append((normalized, ids, self._assign(normalized)))
+        self._sorted_tail = None
+        if len(ids):
+            self._next_id = max(self._next_id, int(ids.max()) + 1)
+        return self
+
+    def _get_sorted_tail(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """addしたベクトルをクラスタ順に並べた (ベクトル, ID, クラスタ, オフセット) を返す. 次のaddまで使い回す."""
+        if self._sorted_tail is None:
+            if self._tail:
+                lists = np.concatenate([lists for _, _, lists in self._tail])
+                order = np.argsort(lists, kind="stable")
+                vectors = np.concatenate([vectors for vectors, _, _ in self._tail])[order]
+                ids = np.concatenate([ids for _, ids, _ in self._tail])[order]
+                lists = lists[order]
+                # 次に並べ直すときは, 整列済みの1組と新しく追加した分だけを連結すればよい
+                self._tail = [(vectors, ids, lists)]
+            else:
+                vectors = np.empty((0, self.centroids.shape[1]), dtype=self.dtype)
+                ids = np.empty(0, dtype=np.int64)
+                lists = np.empty(0, dtype=np.int64)
+            self._sorted_tail = (vectors, ids, lists, np.searchsorted(lists, np.arange(self.n_lists + 1)))
+        return self._sorted_tail
+
+    def search(self, queries, k: int = 10, n_probe: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """各クエリのコサイン類似度が高い上位k件を近似的に求める.
+
+        クエリごとに中心が近いn_probe個のクラスタを選び, クラスタごとにそれを調べるクエリをまとめて計算する.
+
+        Args:
+            queries (np.ndarray or pd.DataFrame): (q, d) のクエリ
+            k (int): 返す件数
+            n_probe (int | None): 調べるクラスタの数. Noneの場合はself.n_probe
+        Returns:
+            tuple[np.ndarray, np.ndarray]: (q, k) のIDと類似度（類似度の降順）. 候補がk件に満たない場合はIDが-1, 類似度が-inf
+        """
+        if self.centroids is None:
+            raise ValueError("train must be called before search")
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        normalized = _normalize_rows(queries, self.dtype)
+        n_queries = len(normalized)
+        probes = np.argpartition(-(normalized @ self.centroids.T), n_probe - 1, axis=1)[:, :n_probe]
+
+        best_scores = np.full((n_queries, k), -np.inf, dtype=self.dtype)
+        best_positions = np.full((n_queries, k), -1, dtype=np.int64)
+        query_ids = np.repeat(np.arange(n_queries), n_probe)
+        list_ids = probes.ravel()
+        order = np.argsort(list_ids, kind="stable")
+        query_ids, list_ids = query_ids[order], list_ids[order]
+        bounds = np.searchsorted(list_ids, np.arange(self.n_lists + 1))
+
+        # 保存済みのベクトルの位置は 0:n_base, addしたベクトルの位置は n_base 以降とする
+        n_base = len(self._ids)
+        base_offsets = self._offsets if self._offsets is not None else np.zeros(self.n_lists + 1, dtype=np.int64)
+        tail_vectors, tail_ids, _, tail_offsets = self._get_sorted_tail()
+        segments = ((self._vectors, base_offsets, 0), (tail_vectors, tail_offsets, n_base))
+        for list_id in range(self.n_lists):
+            members = query_ids[bounds[list_id]:bounds[list_id + 1]]
+            if len(members) == 0:
+                continue
+            for vectors, offsets, position in segments:
+                start, end = offsets[list_id], offsets[list_id + 1]
+                if start == end:
+                    continue
+                scores = normalized[members] @ vectors[start:end].T
+                candidate_scores = np.concatenate([best_scores[members], scores], axis=1)
+                candidate_positions = np.concatenate(
+                    [best_positions[members], np.broadcast_to(np.arange(position + start, position + end), scores.shape)],
+                    axis=1,
+                )
+                top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+                best_scores[members] = np.take_along_axis(candidate_scores, top, axis=1)
+                best_positions[members] = np.take_along_axis(candidate_positions, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_positions = np.take_along_axis(best_positions, order, axis=1)
+        ids = np.full(best_positions.shape, -1, dtype=np.int64)
+        in_base = (best_positions >= 0) & (best_positions < n_base)
+        ids[in_base] = self._ids[best_positions[in_base]]
+        in_tail = best_positions >= n_base
+        ids[in_tail] = tail_ids[best_positions[in_tail] - n_base]
+        return ids, best_scores
+
+    def save(self, directory: str):
+        """インデックスをディレクトリに保存する. 配列は.npyで保存し, loadでメモリマップとして開ける.
+
+        addしたベクトルはクラスタごとに保存済みのベクトルの後ろへ並べて書き出す. 保存済みのベクトルは
+        クラスタ単位でコピーするため, メモリマップで開いたインデックスでも全体をメモリに読み込まない.
+        保存後はこのインデックスも書き出した配列を参照する.
+        """
+        if self.centroids is None:
+            raise ValueError("train must be called before save")
+        os.makedirs(directory, exist_ok=True)
+        tail_vectors, tail_ids, tail_lists, tail_offsets = self._get_sorted_tail()
+        base_offsets = self._offsets if self._offsets is not None else np.zeros(self.n_lists + 1, dtype=np.int64)
+        n = len(self._ids) + len(tail_ids)
+        offsets = base_offsets + tail_offsets
+
+        # 読み込み中のファイルを上書きしないよう, 一時ファイルに書いてから置き換える
+        paths = {name: os.path.join(directory, f"{name}.npy") for name in ("vectors", "ids", "lists")}
+        arrays = {
+            "vectors": np.lib.format.open_memmap(
+                paths["vectors"] + ".tmp", mode="w+", dtype=self.dtype, shape=(n, self.centroids.shape[1])
+            ),
+            "ids": np.lib.format.open_memmap(paths["ids"] + ".tmp", mode="w+", dtype=np.int64, shape=(n,)),
+            "lists": np.lib.format.open_memmap(paths["lists"] + ".tmp", mode="w+", dtype=np.int64, shape=(n,)),
+        }
+        for list_id in range(self.n_lists):
+            start, end = base_offsets[list_id], base_offsets[list_id + 1]
+            tail_start, tail_end = tail_offsets[list_id], tail_offsets[list_id + 1]
+            middle = offsets[list_id] + end - start
+            if end > start:
+                arrays["vectors"][offsets[list_id]:middle] = self._vectors[start:end]
+                arrays["ids"][offsets[list_id]:middle] = self._ids[start:end]
+            arrays["vectors"][middle:offsets[list_id + 1]] = tail_vectors[tail_start:tail_end]
+            arrays["ids"][middle:offsets[list_id + 1]] = tail_ids[tail_start:tail_end]
+            arrays["lists"][offsets[list_id]:offsets[list_id + 1]] = list_id
+        for array in arrays.values():
+            array.flush()
+        # メモリマップを閉じてからファイルを置き換える
+        del arrays
+        for path in paths.values():
+            os.replace(path + ".tmp", path)
+
+        np.save(os.path.join(directory, "centroids.npy"), self.centroids)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(
+                {"n_lists": self.n_lists, "n_probe": self.n_probe, "dtype": np.dtype(self.dtype).name, "seed": self.seed},
+                f,
+            )
+
+        mmap_mode = "r" if isinstance(self._vectors, np.memmap) else None
+        self._vectors = np.load(paths["vectors"], mmap_mode=mmap_mode)
+        self._ids = np.load(paths["ids"], mmap_mode=mmap_mode)
+        self._lists = np.load(paths["lists"], mmap_mode=mmap_mode)
+        self._offsets = offsets
+        self._tail = []
+        self._sorted_tail = None
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "IVFIndex":
+        """saveで保存したインデックスを読み込む. 読み込んだ後もaddで追加できる.
+
+        Args:
+            directory (str): 保存先のディレクトリ
+            mmap (bool): Trueの場合, ベクトルをメモリに読み込まずメモリマップで参照する
+        """
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        index = cls(meta["n_lists"], meta["n_probe"], np.dtype(meta["dtype"]), meta["seed"])
+        mmap_mode = "r" if mmap else None
+        index.centroids = np.load(os.path.join(directory, "centroids.npy"))
+        index._vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode=mmap_mode)
+        index._ids = np.load(os.path.join(directory, "ids.npy"), mmap_mode=mmap_mode)
+        index._lists = np.load(os.path.join(directory, "lists.npy"), mmap_mode=mmap_mode)
+        index._offsets = np.searchsorted(index._lists, np.arange(index.n_lists + 1))
+        index._next_id = int(index._ids.max()) + 1 if len(index._ids) else 0
+        return index
@@ -1,16 +1,61 @@
 import pandas as pd
 import numpy as np
 
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
 
-def cosine_similarity(matrix_a, matrix_b) -> pd.DataFrame:
+
+# 疎行列の入力に対して, 結果の要素数がこれ以下であれば密なデータフレームで返す
+_DENSE_RESULT_LIMIT = 10_000_000
+# stream_self_similarityのconsumerが1要素あたりに使う作業用のバイト数の見積もり.
+# PairHistogramのビン番号(int64)とその計算途中の配列, マスクで取り出したコピーを含む
+_CONSUMER_ELEMENT_BYTES = 32
+
+
+def _is_sparse(matrix) -> bool:
+    return sparse is not None and sparse.issparse(matrix)
+
+
+def _sparse_normalize_rows(matrix):
+    """疎行列の各行をL2ノルムで割る. ノルムが0の行は0のままにする."""
+    if isinstance(matrix, pd.DataFrame):
+        matrix = matrix.values
+    matrix = sparse.csr_matrix(matrix, dtype=np.float64)
+    norm = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    inverse = np.divide(1.0, norm, out=np.zeros_like(norm), where=norm != 0)
+    return sparse.diags(inverse) @ matrix
+
+
+def _sparse_cosine_similarity(matrix_a, matrix_b, sparse_output: bool | None):
+    similarity = (_sparse_normalize_rows(matrix_a) @ _sparse_normalize_rows(matrix_b).T).tocsr()
+    n, m = similarity.shape
+    if sparse_output is None:
+        sparse_output = n * m > _DENSE_RESULT_LIMIT
+    if sparse_output:
+        return similarity
+    return pd.DataFrame(
+        similarity.toarray(),
+        index=matrix_a.index if isinstance(matrix_a, pd.DataFrame) else None,
+        columns=matrix_b.index if isinstance(matrix_b, pd.DataFrame) else None,
+    )
+
+
+def cosine_similarity(matrix_a, matrix_b, sparse_output: bool | None = None) -> pd.DataFrame:
     """
     コサイン類似度を計算する関数
+    どちらかの入力がscipy.sparseの疎行列の場合は, 密行列に変換せずに疎行列同士の積で計算する.
     Args:
-        matrix_a (pd.DataFrame or np.ndarray): 入力行列A
-        matrix_b (pd.DataFrame or np.ndarray): 入力行列B
+        matrix_a (pd.DataFrame or np.ndarray or scipy.sparse): 入力行列A
+        matrix_b (pd.DataFrame or np.ndarray or scipy.sparse): 入力行列B
+        sparse_output (bool | None): 疎行列の入力に対して結果を疎行列で返すかどうか.
+            Noneの場合は結果の要素数が1000万を超えるときだけ疎行列で返す. 密な入力では無視する
     Returns:
-        pd.DataFrame: コサイン類似度を含むデータフレーム
+        pd.DataFrame or scipy.sparse.csr_matrix: コサイン類似度を含むデータフレーム（または疎行列）
     """
+    if _is_sparse(matrix_a) or _is_sparse(matrix_b):
+        return _sparse_cosine_similarity(matrix_a, matrix_b, sparse_output)
     if not isinstance(matrix_a, pd.DataFrame):
         matrix_a = pd.DataFrame(matrix_a)
     if not isinstance(matrix_b, pd.DataFrame):
@@ -30,6 +75,250 @@ def cosine_similarity(matrix_a, matrix_b) -> pd.DataFrame:
     return df_cos
 
 
+def _normalize_rows(matrix, dtype=np.float32) -> np.ndarray:
+    """各行をL2ノルムで割った配列を返す. ノルムが0の行は0のままにする（cosine_similarityのfillna(0)と同じ扱い）."""
+    if isinstance(matrix, pd.DataFrame):
+        matrix = matrix.values
+    matrix = np.array(matrix, dtype=dtype)
+    if matrix.ndim == 1:
+        matrix = matrix[np.newaxis, :]
+    norm = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norm, out=matrix, where=norm != 0)
+    return matrix
+
+
+def _tile_sizes(n: int, m: int, element_bytes: int, memory_budget: int, extra_cols: int = 0) -> tuple[int, int]:
+    """(行数, 列数) のタイルの大きさを決める.
+
+    1要素あたりelement_bytesバイトの (行数, 列数 + extra_cols) の作業用配列がmemory_budgetバイトに収まるようにする.
+    """
+    cols = min(m, max(1, memory_budget // element_bytes - extra_cols))
+    rows = min(n, max(1, memory_budget // (element_bytes * (cols + extra_cols))))
+    return rows, cols
+
+
+def _iter_tiles(normalized_a: np.ndarray, normalized_b: np.ndarray, memory_budget: int, element_bytes: int | None = None, extra_cols: int = 0):
+    """正規化済みの行列をタイルに分けて類似度を計算する.
+
+    Args:
+        element_bytes (int | None): 類似度1要素あたりに使う作業用のバイト数. Noneの場合は類似度の型の大きさ
+        extra_cols (int): タイルの行ごとに追加で使う作業用の列数
+
+    Yields:
+        tuple[int, int, np.ndarray]: (行の開始位置, 列の開始位置, タイルの類似度行列)
+    """
+    n, m = len(normalized_a), len(normalized_b)
+    rows, cols = _tile_sizes(n, m, element_bytes or normalized_a.itemsize, memory_budget, extra_cols)
+    for row in range(0, n, rows):
+        block_a = normalized_a[row:row + rows]
+        for col in range(0, m, cols):
+            yield row, col, block_a @ normalized_b[col:col + cols].T
+
+
+def cosine_similarity_topk(matrix_a, matrix_b, k: int = 10, memory_budget: int = 256 * 1024 ** 2, dtype=np.float32, exclude_self: bool = False) -> tuple[np.ndarray, np.ndarray]:
+    """
+    matrix_aの各行について, コサイン類似度が高いmatrix_bの行を上位k件だけ求める関数.
+    n×mの類似度行列全体は確保せず, memory_budgetに収まるタイルごとに計算する.
+    Args:
+        matrix_a (pd.DataFrame or np.ndarray): 入力行列A
+        matrix_b (pd.DataFrame or np.ndarray): 入力行列B
+        k (int): 各行について返す件数
+        memory_budget (int): 1タイルの計算に使う作業用メモリの上限（バイト）. 類似度行列, argpartitionの添字, 上位k件の統合に使う配列を含む
+        dtype: 計算に使う型（np.float32 または np.float64）
+        exclude_self (bool): Trueの場合, 同じ位置の行同士（自己類似度）を除く. cosine_similarity_topk(df, df)で使う
+    Returns:
+        tuple[np.ndarray, np.ndarray]: (n, k) のmatrix_bの行番号と, その類似度（類似度の降順）
+    """
+    normalized_a = _normalize_rows(matrix_a, dtype)
+    normalized_b = _normalize_rows(matrix_b, dtype)
+    n, m = len(normalized_a), len(normalized_b)
+    k = min(k, m - 1 if exclude_self else m)
+
+    best_scores = np.full((n, k), -np.inf, dtype=dtype)
+    best_indices = np.zeros((n, k), dtype=np.int64)
+    # タイル1要素あたり, 類似度とargpartitionが返すint64の添字を同時に持つ.
+    # 統合には行ごとに (類似度, 添字) の2k列の候補と, それを選び直す添字を使う
+    element_bytes = normalized_a.itemsize + 8
+    tiles = _iter_tiles(normalized_a, normalized_b, memory_budget, element_bytes=element_bytes, extra_cols=4 * k)
+    for row, col, scores in tiles:
+        rows = np.arange(row, row + len(scores))
+        if exclude_self:
+            diagonal = (rows >= col) & (rows < col + scores.shape[1])
+            scores[diagonal.nonzero()[0], rows[diagonal] - col] = -np.inf
+        # タイルの中で先に上位k件に絞り, 小さな候補だけをこれまでの上位k件と統合する.
+        # 符号はその場で反転し, 類似度行列のコピーを作らない
+        if scores.shape[1] > k:
+            np.negative(scores, out=scores)
+            top = np.argpartition(scores, k - 1, axis=1)[:, :k].copy()
+            tile_scores = -np.take_along_axis(scores, top, axis=1)
+            tile_indices = top + col
+        else:
+            tile_scores = scores
+            tile_indices = np.broadcast_to(np.arange(col, col + scores.shape[1]), scores.shape)
+        # 次のタイルを計算する前に類似度行列を解放する
+        del scores
+
+        candidate_scores = np.concatenate([best_scores[rows], tile_scores], axis=1)
+        candidate_indices = np.concatenate([best_indices[rows], tile_indices], axis=1)
+        top = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+        best_scores[rows] = np.take_along_axis(candidate_scores, top, axis=1)
+        best_indices[rows] = np.take_along_axis(candidate_indices, top, axis=1)
+
+    order = np.argsort(-best_scores, axis=1)
+    return np.take_along_axis(best_indices, order, axis=1), np.take_along_axis(best_scores, order, axis=1)
+
+
+def cosine_similarity_threshold(matrix_a, matrix_b, threshold: float, memory_budget: int = 256 * 1024 ** 2, dtype=np.float32):
+    """
+    コサイン類似度がthreshold以上のペアだけを疎行列で返す関数.
+    n×mの類似度行列全体は確保せず, memory_budgetに収まるタイルごとに計算する.
+    Args:
+        matrix_a (pd.DataFrame or np.ndarray): 入力行列A
+        matrix_b (pd.DataFrame or np.ndarray): 入力行列B
+        threshold (float): 残す類似度の下限
+        memory_budget (int): 1タイルの類似度行列に使うメモリの上限（バイト）
+        dtype: 計算に使う型（np.float32 または np.float64）
+    Returns:
+        scipy.sparse.csr_matrix: (n, m) の疎行列. threshold未満のペアは格納されない
+    """
+    if sparse is None:
+        raise ImportError("scipy is required for cosine_similarity_threshold")
+    normalized_a = _normalize_rows(matrix_a, dtype)
+    normalized_b = _normalize_rows(matrix_b, dtype)
+    rows, cols, values = [], [], []
+    for row, col, scores in _iter_tiles(normalized_a, normalized_b, memory_budget):
+        tile_rows, tile_cols = np.nonzero(scores >= threshold)
+        rows.append(tile_rows + row)
+        cols.append(tile_cols + col)
+        values.append(scores[tile_rows, tile_cols])
+    shape = (len(normalized_a), len(normalized_b))
+    if not values:
+        return sparse.csr_matrix(shape, dtype=dtype)
+    return sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=shape
+    )
+
+
+class PairHistogram:
+    """自己類似度の上三角のペアの値をヒストグラムに集計する. メモリはビン数だけ使う."""
+
+    def __init__(self, bins: int = 200, range: tuple[float, float] = (-1.0, 1.0)):
+        self.edges = np.linspace(range[0], range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self._scale = float(bins / (range[1] - range[0]))
+
+    def update(self, block: np.ndarray, row: int, col: int, mask: np.ndarray | None):
+        values = block if mask is None else block[mask]
+        # np.histogramより速いように, ビン番号を直接求めてbincountする（範囲外は端のビンに入れる）.
+        # float64に上げないよう, 端とスケールはPythonのfloatとしてブロックの型のまま計算する
+        scaled = values.ravel() - float(self.edges[0])
+        scaled *= self._scale
+        index = scaled.astype(np.intp)
+        del scaled
+        np.clip(index, 0, len(self.counts) - 1, out=index)
+        self.counts += np.bincount(index, minlength=len(self.counts))
+
+    def quantile(self, q):
+        """ヒストグラムから分位点を求める. ビン内は一様に分布しているとみなして線形補間する."""
+        cumulative = np.concatenate([[0], np.cumsum(self.counts)])
+        return np.interp(np.asarray(q) * cumulative[-1], cumulative, self.edges)
+
+
+class PairMoments:
+    """自己類似度の上三角のペアの件数・平均・分散・最小値・最大値をブロックごとに合成して求める."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self._m2 = 0.0
+
+    def update(self, block: np.ndarray, row: int, col: int, mask: np.ndarray | None):
+        values = block if mask is None else block[mask]
+        if values.size == 0:
+            return
+        count = values.size
+        mean = float(values.mean(dtype=np.float64))
+        m2 = float(((values - mean) ** 2).sum(dtype=np.float64))
+        # Chanらの方法でブロックの統計量を合成する
+        total = self.count + count
+        delta = mean - self.mean
+        self._m2 += m2 + delta ** 2 * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    @property
+    def variance(self) -> float:
+        return self._m2 / self.count if self.count else float("nan")
+
+
+class PairsAboveThreshold:
+    """自己類似度がthreshold以上のペア (i < j) を集める."""
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._rows, self._cols, self._values = [], [], []
+
+    def update(self, block: np.ndarray, row: int, col: int, mask: np.ndarray | None):
+        hit = block >= self.threshold
+        if mask is not None:
+            hit &= mask
+        rows, cols = np.nonzero(hit)
+        self._rows.append(rows + row)
+        self._cols.append(cols + col)
+        self._values.append(block[rows, cols])
+
+    def result(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(行番号i, 行番号j, 類似度) の配列を返す."""
+        if not self._values:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(self._rows), np.concatenate(self._cols), np.concatenate(self._values)
+
+
+def stream_self_similarity(matrix, consumers, memory_budget: int = 256 * 1024 ** 2, dtype=np.float32):
+    """
+    cosine_similarity(df, df)の上三角（i < j）のペアだけをブロックごとに計算し, consumersに渡す関数.
+    flatten_self_sim_dfと違い, n×nの行列を確保せず, 各ペアも1回しか計算しない.
+    Args:
+        matrix (pd.DataFrame or np.ndarray): 入力行列
+        consumers: update(block, row, col, mask) を持つオブジェクト（PairHistogram, PairMoments, PairsAboveThreshold など）またはそのリスト.
+            blockは matrix[row:] と matrix[col:] の類似度のブロックで, maskがNoneでない場合はmaskがTrueの要素だけが上三角のペア.
+            consumerの作業用配列を抑えるため, 類似度のブロックは行ごとに分けて渡す
+        memory_budget (int): 類似度のブロック, 対角ブロックのマスク, consumerの作業用配列に使うメモリの上限（バイト）
+        dtype: 計算に使う型（np.float32 または np.float64）
+    Returns:
+        consumers: 渡したconsumers
+    """
+    targets = consumers if isinstance(consumers, (list, tuple)) else [consumers]
+    normalized = _normalize_rows(matrix, dtype)
+    n = len(normalized)
+    # 予算の3/4を類似度のブロックと対角ブロックのマスク(1要素1バイト)に, 残りをconsumerに渡す行の作業用配列に割り当てる
+    size = max(1, int(np.sqrt(memory_budget * 3 // 4 // (normalized.itemsize + 1))))
+    chunk_rows = max(1, memory_budget // 4 // (_CONSUMER_ELEMENT_BYTES * size))
+    masks = {}
+    for row in range(0, n, size):
+        block_a = normalized[row:row + size]
+        for col in range(row, n, size):
+            block = block_a @ normalized[col:col + size].T
+            mask = None
+            if col == row:
+                # 対角ブロックは狭義上三角だけを使う
+                if block.shape not in masks:
+                    masks[block.shape] = np.triu(np.ones(block.shape, dtype=bool), k=1)
+                mask = masks[block.shape]
+            for start in range(0, len(block), chunk_rows):
+                chunk = block[start:start + chunk_rows]
+                chunk_mask = None if mask is None else mask[start:start + chunk_rows]
+                for consumer in targets:
+                    consumer.update(chunk, row + start, col, chunk_mask)
+            # 次のブロックを計算する前に, ブロックを参照するビューごと解放する
+            del block, chunk, chunk_mask
+    return consumers
+
+
 def flatten_self_sim_df(df_cos: pd.DataFrame) -> np.ndarray:
     """
     cosine_similarity(df, df)のように自己類似度を計算した結果のデータフレームをフラットな形式に変換する関数
@@ -1,6 +1,14 @@
+import math
+from collections import deque
+
 import numpy as np
 import pandas as pd
 
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
 def get_entropy(num_list):
     """
     リストからエントロピーを計算（ベクトル計算版）。
@@ -10,8 +18,7 @@ def get_entropy(num_list):
         float: エントロピーの値。
     """
     # NumPy配列に変換
-    if not isinstance(num_list, np.ndarray):
-        counts = np.array(num_list)
+    counts = np.asarray(num_list)
     
     # 各要素の出現確率を一度に計算
     probabilities = counts / counts.sum()
@@ -24,25 +31,62 @@ def get_entropy(num_list):
     
     return entropy
 
-def get_entropy_all(matrix):
+def _segment_entropies(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    values[offsets[i]:offsets[i + 1]] を行iの度数とみなし, 各行のエントロピーを非ゼロ要素だけで計算する。
+    """
+    values = np.asarray(values, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_rows = len(offsets) - 1
+    # 各要素が属する行の番号. 空の行があってもよい
+    row_ids = np.repeat(np.arange(n_rows), np.diff(offsets))
+    values = values[offsets[0]:offsets[-1]]
+
+    row_sums = np.bincount(row_ids, weights=values, minlength=n_rows)
+    safe_row_sums = np.where(row_sums > 0, row_sums, 1)
+    probabilities = values / safe_row_sums[row_ids]
+    term = np.zeros_like(probabilities)
+    non_zero_mask = probabilities > 0
+    term[non_zero_mask] = probabilities[non_zero_mask] * np.log2(probabilities[non_zero_mask])
+    return -np.bincount(row_ids, weights=term, minlength=n_rows)
+
+
+def get_entropy_all(matrix, offsets=None):
     """
     各行のエントロピーをまとめて計算する関数（完全ベクトル計算版）。
-    
+
+    行ごとに長さが異なる入力は, 長さの異なるリストのリスト, scipy.sparseの疎行列,
+    またはCSR形式の値と区切り位置（matrixに全行の値を連結した1次元配列, offsetsに各行の開始位置と末尾）で渡せる。
+    これらの場合は0埋めした2次元配列を作らず, 非ゼロの要素だけを行ごとに集計する。
+
     Args:
-        matrix (np.ndarray or pd.DataFrame): 各行が度数分布または確率分布を表す2次元配列。
-        
+        matrix (np.ndarray or pd.DataFrame or list or scipy.sparse): 各行が度数分布または確率分布を表す2次元配列。
+            offsetsを指定した場合は全行の値を連結した1次元配列。
+        offsets (array-like | None): 行iの値が matrix[offsets[i]:offsets[i + 1]] にあることを表す長さ n + 1 の配列。
+
     Returns:
         np.ndarray: 各行のエントロピーを格納した1次元配列。
     """
+    if offsets is not None:
+        return _segment_entropies(matrix, offsets)
+    if sparse is not None and sparse.issparse(matrix):
+        matrix = sparse.csr_matrix(matrix, copy=True)
+        # 重複した要素は足し合わせてから集計する
+        matrix.sum_duplicates()
+        return _segment_entropies(matrix.data, matrix.indptr)
+
     # NumPy配列に変換
     if isinstance(matrix, pd.DataFrame):
         matrix = matrix.values
     elif isinstance(matrix, list):
-        # リストの長さが異なる場合、NumPy配列に変換できないため、値に影響が出ないように値を追加する
-        max_length = max(len(row) for row in matrix)
-        matrix = [row + [0] * (max_length - len(row)) for row in matrix]
+        # リストの長さが異なる場合は0埋めせず, 値を連結して区切り位置とともに集計する
+        lengths = np.fromiter((len(row) for row in matrix), dtype=np.int64, count=len(matrix))
+        if len(matrix) > 0 and (lengths != lengths[0]).any():
+            offsets = np.concatenate([[0], np.cumsum(lengths)])
+            values = np.fromiter((value for row in matrix for value in row), dtype=np.float64, count=offsets[-1])
+            return _segment_entropies(values, offsets)
         matrix = np.array(matrix)
-    
+
     # 1. 各行の合計を計算 (形状を(n, 1)にしてブロードキャスト可能にする)
     row_sums = matrix.sum(axis=1, keepdims=True)
     
@@ -63,4 +107,177 @@ def get_entropy_all(matrix):
     # 5. 各行の合計を計算してエントロピーを求める
     entropies = -np.sum(term, axis=1)
     
-    return entropies
\ No newline at end of file
+    return entropies
+
+def _scalar_xlogx(x: float, log_base: float) -> float:
+    """スカラー用の x * log(x). NumPyを経由しないため, 1件ずつの更新でも軽い."""
+    return x * math.log(x) / log_base if x > 0 else 0.0
+
+
+def _xlogx(x, base: float):
+    """x * log(x) を求める（0 log 0 = 0）. スカラーと配列の両方を受け付ける."""
+    x = np.asarray(x, dtype=np.float64)
+    log = np.zeros_like(x)
+    np.log(x, out=log, where=x > 0)
+    return x * log / np.log(base)
+
+
+class OnlineEntropy:
+    """カテゴリの度数を1件ずつ増減しながら, エントロピーをO(1)で更新する.
+
+    度数の合計 N と S = Σ c log c を保持し, H = log N - S / N で求める.
+    長時間の更新で浮動小数点の誤差がたまった場合はrecomputeで計算し直せる.
+
+    Example:
+        accumulator = OnlineEntropy()
+        for hashtag in hashtags:
+            accumulator.increment(hashtag)
+        accumulator.entropy
+    """
+
+    def __init__(self, base: float = 2):
+        """
+        Args:
+            base (float): 対数の底. get_entropyと同じく既定値は2
+        """
+        self.base = base
+        self._log_base = math.log(base)
+        self.counts = {}
+        self.total = 0
+        self._sum_xlogx = 0.0
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def increment(self, category, amount=1):
+        """categoryの度数をamountだけ増やす."""
+        old = self.counts.get(category, 0)
+        new = old + amount
+        if new < 0:
+            raise ValueError(f"Count of {category!r} would become negative: {new}")
+        self._sum_xlogx += _scalar_xlogx(new, self._log_base) - _scalar_xlogx(old, self._log_base)
+        self.total += amount
+        if new == 0:
+            del self.counts[category]
+        else:
+            self.counts[category] = new
+
+    def decrement(self, category, amount=1):
+        """categoryの度数をamountだけ減らす."""
+        self.increment(category, -amount)
+
+    @property
+    def entropy(self) -> float:
+        """現在の度数分布のエントロピー. 度数がない場合は0."""
+        if self.total <= 0:
+            return 0.0
+        return max(0.0, _scalar_xlogx(self.total, self._log_base) / self.total - self._sum_xlogx / self.total)
+
+    def recompute(self):
+        """保持している度数からSを計算し直し, 累積した丸め誤差をなくす."""
+        counts = np.fromiter(self.counts.values(), dtype=np.float64, count=len(self.counts))
+        self._sum_xlogx = float(_xlogx(counts, self.base).sum())
+        self.total = counts.sum() if len(counts) else 0
+
+
+class SlidingWindowEntropy:
+    """直近size件, または直近duration秒のイベントについてのエントロピーを保持する.
+
+    イベントを追加するたびにウィンドウから外れたものを取り除くため, 各イベントの処理はならしてO(1).
+    """
+
+    def __init__(self, size: int | None = None, duration: float | None = None, base: float = 2):
+        """
+        Args:
+            size (int | None): ウィンドウに含める最大件数
+            duration (float | None): ウィンドウの長さ（timestampと同じ単位）
+            base (float): 対数の底
+        """
+        if size is None and duration is None:
+            raise ValueError("Either size or duration must be specified")
+        self.size = size
+        self.duration = duration
+        self.accumulator = OnlineEntropy(base)
+        self._events = deque()
+
+    def add(self, category, timestamp: float | None = None):
+        """イベントを追加し, ウィンドウから外れたイベントを取り除く. durationを指定した場合はtimestampが必要."""
+        if self.duration is not None and timestamp is None:
+            raise ValueError("timestamp is required when duration is specified")
+        self._events.append((timestamp, category))
+        self.accumulator.increment(category)
+        self.expire(timestamp)
+
+    def expire(self, now: float | None = None):
+        """ウィンドウから外れたイベントを取り除く. 新しいイベントがなくても時刻を進めたい場合に呼ぶ."""
+        while self.size is not None and len(self._events) > self.size:
+            self.accumulator.decrement(self._events.popleft()[1])
+        if self.duration is not None and now is not None:
+            while self._events and self._events[0][0] <= now - self.duration:
+                self.accumulator.decrement(self._events.popleft()[1])
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    @property
+    def entropy(self) -> float:
+        return self.accumulator.entropy
+
+
+class BatchedOnlineEntropy:
+    """多数の独立したストリームのエントロピーを, 配列演算でまとめて更新する.
+
+    ストリームとカテゴリは0始まりの整数で表し, 度数は (n_streams, n_categories) の配列で保持する.
+    """
+
+    def __init__(self, n_streams: int, n_categories: int, base: float = 2):
+        """
+        Args:
+            n_streams (int): ストリームの数
+            n_categories (int): カテゴリの数
+            base (float): 対数の底
+        """
+        self.base = base
+        self.n_categories = n_categories
+        self.counts = np.zeros((n_streams, n_categories), dtype=np.int64)
+        self.totals = np.zeros(n_streams, dtype=np.int64)
+        self._sum_xlogx = np.zeros(n_streams, dtype=np.float64)
+
+    def update(self, streams, categories, amounts=1):
+        """各イベント (streams[i], categories[i]) の度数をamounts[i]だけ増減する. 同じ組が複数あってもよい.
+
+        Raises:
+            ValueError: ストリームやカテゴリの番号が範囲外の場合, または度数が負になる場合
+        """
+        streams = np.asarray(streams, dtype=np.int64)
+        categories = np.asarray(categories, dtype=np.int64)
+        amounts = np.broadcast_to(np.asarray(amounts, dtype=np.int64), streams.shape)
+        # 範囲外のカテゴリは別のストリームの度数として数えられてしまうので, ここで弾く
+        n_streams = len(self.counts)
+        if streams.size and (streams.min() < 0 or streams.max() >= n_streams):
+            raise ValueError(f"Stream index out of range [0, {n_streams})")
+        if categories.size and (categories.min() < 0 or categories.max() >= self.n_categories):
+            raise ValueError(f"Category index out of range [0, {self.n_categories})")
+        # 同じ (ストリーム, カテゴリ) の組をまとめ, 組ごとに1回だけSを更新する
+        keys, inverse = np.unique(streams * self.n_categories + categories, return_inverse=True)
+        deltas = np.bincount(inverse, weights=amounts, minlength=len(keys)).astype(np.int64)
+        rows, cols = np.divmod(keys, self.n_categories)
+        old = self.counts[rows, cols]
+        new = old + deltas
+        if (new < 0).any():
+            raise ValueError("Counts would become negative")
+        self.counts[rows, cols] = new
+        np.add.at(self._sum_xlogx, rows, _xlogx(new, self.base) - _xlogx(old, self.base))
+        np.add.at(self.totals, rows, deltas)
+
+    def entropy(self) -> np.ndarray:
+        """各ストリームのエントロピー. 度数がないストリームは0."""
+        totals = self.totals.astype(np.float64)
+        safe_totals = np.where(totals > 0, totals, 1)
+        entropies = _xlogx(totals, self.base) / safe_totals - self._sum_xlogx / safe_totals
+        return np.maximum(entropies, 0)
+
+    def recompute(self):
+        """度数からSを計算し直し, 累積した丸め誤差をなくす."""
+        self._sum_xlogx = _xlogx(self.counts, self.base).sum(axis=1)
+        self.totals = self.counts.sum(axis=1)
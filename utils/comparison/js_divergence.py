@@ -1,27 +1,186 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 
+try:
+    from scipy import sparse
+except ImportError:
+    sparse = None
+
 
 def get_KL_divergence(p, q):
-    return sum([p[i] * np.log(p[i] / q[i]) for i in range(len(p)) if p[i] != 0])
+    return paired_kl_divergence(p, q)
 
 
 def get_JS_divergence(p, q):
+    return paired_js_divergence(p, q)
+
+
+def _kl_terms(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """各行の Σ p log(p / q) を求める. pが0の要素は0, pが正でqが0の要素はinfになる."""
+    ratio = np.ones_like(p)
+    with np.errstate(divide="ignore"):
+        np.divide(p, q, out=ratio, where=p > 0)
+    return np.einsum("ij,ij->i", p, np.log(ratio))
+
+
+def _js_terms(p: np.ndarray, q: np.ndarray) -> np.ndarray:
     m = (p + q) / 2
-    return 0.5 * get_KL_divergence(p, m) + 0.5 * get_KL_divergence(q, m)
+    return 0.5 * _kl_terms(p, m) + 0.5 * _kl_terms(q, m)
+
+
+def _hellinger_terms(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    diff = np.sqrt(p) - np.sqrt(q)
+    return np.sqrt(0.5 * np.einsum("ij,ij->i", diff, diff))
+
+
+def _total_variation_terms(p: np.ndarray, q: np.ndarray) -> np.ndarray:
+    return 0.5 * np.abs(p - q).sum(axis=1)
+
+
+def _paired(kernel, p, q, smoothing: float, chunk_size: int):
+    """
+    pの行iとqの行iの組ごとにkernelを適用する. 配列はchunk_size行ずつ処理する。
+    1次元の入力は1組として扱い, スカラーを返す。
+    """
+    p = np.asarray(p.values if isinstance(p, (pd.DataFrame, pd.Series)) else p, dtype=np.float64)
+    q = np.asarray(q.values if isinstance(q, (pd.DataFrame, pd.Series)) else q, dtype=np.float64)
+    if p.shape != q.shape:
+        raise ValueError(f"p and q must have the same shape, got {p.shape} and {q.shape}")
+    scalar = p.ndim == 1
+    p, q = np.atleast_2d(p), np.atleast_2d(q)
+
+    result = np.empty(len(p), dtype=np.float64)
+    for start in range(0, len(p), chunk_size):
+        p_chunk = p[start:start + chunk_size]
+        q_chunk = q[start:start + chunk_size]
+        if smoothing > 0:
+            # 加算スムージングの後, 各行の合計が1になるように正規化する
+            p_chunk = p_chunk + smoothing
+            q_chunk = q_chunk + smoothing
+            p_chunk /= p_chunk.sum(axis=1, keepdims=True)
+            q_chunk /= q_chunk.sum(axis=1, keepdims=True)
+        result[start:start + chunk_size] = kernel(p_chunk, q_chunk)
+    return result[0] if scalar else result
+
+
+def paired_kl_divergence(p, q, smoothing: float = 0.0, base: float | None = None, chunk_size: int = 65536):
+    """
+    pの行iとqの行iの間のKLダイバージェンス D_KL(P||Q) を行ごとに計算する関数。
+
+    Args:
+        p (np.ndarray or pd.DataFrame): 確率分布を各行に格納した (n, d) の配列。1次元の場合は1つの分布として扱う。
+        q (np.ndarray or pd.DataFrame): pと同じ形の配列。
+        smoothing (float): 0より大きい場合, 各要素にこの値を足してから各行を正規化する。
+        base (float | None): 対数の底。Noneの場合は自然対数。
+        chunk_size (int): 一度に処理する行数。
+
+    Returns:
+        np.ndarray: 各行のKLダイバージェンス。入力が1次元の場合はスカラー。
+    """
+    result = _paired(_kl_terms, p, q, smoothing, chunk_size)
+    return result / np.log(base) if base is not None else result
+
+
+def paired_js_divergence(p, q, smoothing: float = 0.0, base: float | None = None, chunk_size: int = 65536):
+    """
+    pの行iとqの行iの間のJSダイバージェンスを行ごとに計算する関数。
+
+    Args:
+        p (np.ndarray or pd.DataFrame): 確率分布を各行に格納した (n, d) の配列。1次元の場合は1つの分布として扱う。
+        q (np.ndarray or pd.DataFrame): pと同じ形の配列。
+        smoothing (float): 0より大きい場合, 各要素にこの値を足してから各行を正規化する。
+        base (float | None): 対数の底。Noneの場合は自然対数。
+        chunk_size (int): 一度に処理する行数。
+
+    Returns:
+        np.ndarray: 各行のJSダイバージェンス。入力が1次元の場合はスカラー。
+    """
+    result = _paired(_js_terms, p, q, smoothing, chunk_size)
+    return result / np.log(base) if base is not None else result
+
+
+def paired_hellinger_distance(p, q, smoothing: float = 0.0, chunk_size: int = 65536):
+    """
+    pの行iとqの行iの間のヘリンジャー距離 sqrt(0.5 * Σ (√p - √q)^2) を行ごとに計算する関数。
+
+    Args:
+        p (np.ndarray or pd.DataFrame): 確率分布を各行に格納した (n, d) の配列。1次元の場合は1つの分布として扱う。
+        q (np.ndarray or pd.DataFrame): pと同じ形の配列。
+        smoothing (float): 0より大きい場合, 各要素にこの値を足してから各行を正規化する。
+        chunk_size (int): 一度に処理する行数。
+
+    Returns:
+        np.ndarray: 各行のヘリンジャー距離。入力が1次元の場合はスカラー。
+    """
+    return _paired(_hellinger_terms, p, q, smoothing, chunk_size)
+
+
+def paired_total_variation(p, q, smoothing: float = 0.0, chunk_size: int = 65536):
+    """
+    pの行iとqの行iの間の全変動距離 0.5 * Σ |p - q| を行ごとに計算する関数。
+
+    Args:
+        p (np.ndarray or pd.DataFrame): 確率分布を各行に格納した (n, d) の配列。1次元の場合は1つの分布として扱う。
+        q (np.ndarray or pd.DataFrame): pと同じ形の配列。
+        smoothing (float): 0より大きい場合, 各要素にこの値を足してから各行を正規化する。
+        chunk_size (int): 一度に処理する行数。
+
+    Returns:
+        np.ndarray: 各行の全変動距離。入力が1次元の場合はスカラー。
+    """
+    return _paired(_total_variation_terms, p, q, smoothing, chunk_size)
+
+
+def _sparse_js_divergence(matrix_a, matrix_b) -> np.ndarray:
+    """
+    疎行列同士の全ペアのJSダイバージェンスを, 両方が非ゼロの要素だけを調べて計算する。
+
+    片方だけが非ゼロの要素 x の寄与は 0.5 * x * log(2) になるため,
+    JS(P, Q) = 0.5 * log(2) * (ΣP + ΣQ) + Σ_{p>0, q>0} [0.5 * p * log(p / (p + q)) + 0.5 * q * log(q / (p + q))]
+    と分解し, 第2項だけを列ごとに両方の非ゼロ要素の組について足し込む。
+    """
+    a = sparse.csc_matrix(matrix_a.values if isinstance(matrix_a, pd.DataFrame) else matrix_a, dtype=np.float64)
+    b = sparse.csc_matrix(matrix_b.values if isinstance(matrix_b, pd.DataFrame) else matrix_b, dtype=np.float64)
+    a.eliminate_zeros()
+    b.eliminate_zeros()
+    sum_a = np.asarray(a.sum(axis=1)).ravel()
+    sum_b = np.asarray(b.sum(axis=1)).ravel()
+    js_divergence = 0.5 * np.log(2) * (sum_a[:, np.newaxis] + sum_b[np.newaxis, :])
+
+    for column in range(a.shape[1]):
+        rows_a = a.indices[a.indptr[column]:a.indptr[column + 1]]
+        rows_b = b.indices[b.indptr[column]:b.indptr[column + 1]]
+        if len(rows_a) == 0 or len(rows_b) == 0:
+            continue
+        p = a.data[a.indptr[column]:a.indptr[column + 1]][:, np.newaxis]
+        q = b.data[b.indptr[column]:b.indptr[column + 1]][np.newaxis, :]
+        total = p + q
+        js_divergence[np.ix_(rows_a, rows_b)] += 0.5 * p * np.log(p / total) + 0.5 * q * np.log(q / total)
+    return js_divergence
 
 
 def get_js_divergence_at_once(matrix_a, matrix_b):
     """
     2つのデータフレームに含まれる全確率分布ペアのJSダイバージェンスを計算する関数。
+    どちらかの入力がscipy.sparseの疎行列の場合は, 両方が非ゼロの要素だけを調べる疎行列用の計算を行う。
 
     Args:
-        matrix_a (pd.DataFrame or np.ndarray): 確率分布を各行に格納したデータフレームまたはNumpy配列。
-        matrix_b (pd.DataFrame or np.ndarray): 確率分布を各行に格納したデータフレームまたはNumpy配列。
+        matrix_a (pd.DataFrame or np.ndarray or scipy.sparse): 確率分布を各行に格納したデータフレームまたはNumpy配列。
+        matrix_b (pd.DataFrame or np.ndarray or scipy.sparse): 確率分布を各行に格納したデータフレームまたはNumpy配列。
 
     Returns:
         pd.DataFrame: matrix_aの各行とmatrix_bの各行の間のJSダイバージェンスを格納したデータフレーム。
     """
+    if sparse is not None and (sparse.issparse(matrix_a) or sparse.issparse(matrix_b)):
+        return pd.DataFrame(
+            _sparse_js_divergence(matrix_a, matrix_b),
+            index=matrix_a.index if isinstance(matrix_a, pd.DataFrame) else None,
+            columns=matrix_b.index if isinstance(matrix_b, pd.DataFrame) else None,
+        )
+
     # 入力がNumpy配列の場合、データフレームに変換
     if not isinstance(matrix_a, pd.DataFrame):
         matrix_a = pd.DataFrame(matrix_a)
@@ -62,4 +221,74 @@ def get_js_divergence_at_once(matrix_a, matrix_b):
     js_divergence = 0.5 * kl_p_m + 0.5 * kl_q_m
 
     # 結果をデータフレームに格納して返す
-    return pd.DataFrame(js_divergence, index=matrix_a.index, columns=matrix_b.index)
\ No newline at end of file
+    return pd.DataFrame(js_divergence, index=matrix_a.index, columns=matrix_b.index)
+
+
+def _row_entropies(matrix: np.ndarray) -> np.ndarray:
+    """各行の -Σ x log x を求める（0 log 0 = 0）."""
+    log = np.zeros_like(matrix)
+    np.log(matrix, out=log, where=matrix > 0)
+    return -np.einsum("ij,ij->i", matrix, log)
+
+
+def _js_tile(p: np.ndarray, q: np.ndarray, entropy_p: np.ndarray, entropy_q: np.ndarray) -> np.ndarray:
+    """pの各行とqの各行の間のJSダイバージェンスを, 行ごとのエントロピーを使って求める. (len(p), len(q), d) の配列を作る."""
+    mixture = (p[:, np.newaxis, :] + q[np.newaxis, :, :]) / 2
+    log = np.zeros_like(mixture)
+    np.log(mixture, out=log, where=mixture > 0)
+    mixture *= log
+    entropy_m = -mixture.sum(axis=2)
+    tile = entropy_m - (entropy_p[:, np.newaxis] + entropy_q[np.newaxis, :]) / 2
+    # 丸め誤差で負になった値は0にする
+    return np.maximum(tile, 0)
+
+
+def get_js_divergence_chunked(matrix_a, matrix_b, memory_budget: int = 256 * 1024 ** 2, n_jobs: int | None = None):
+    """
+    get_js_divergence_at_onceと同じ値を, (n, m, d) のテンソルを作らずにタイルごとに計算する関数。
+
+    JS(P, Q) = H(M) - (H(P) + H(Q)) / 2 （H(X) = -Σ x log x, M = (P + Q) / 2）を使い,
+    H(P), H(Q) は行ごとに1回だけ求め, タイルではH(M)だけを計算する。
+    タイルはスレッドで並列に処理する（NumPyの演算中はGILが解放されるため複数コアを使える）。
+    結果は浮動小数点の丸め誤差（1e-15程度の絶対誤差）の範囲でget_js_divergence_at_onceと一致する。
+
+    Args:
+        matrix_a (pd.DataFrame or np.ndarray): 確率分布を各行に格納したデータフレームまたはNumpy配列。
+        matrix_b (pd.DataFrame or np.ndarray): 確率分布を各行に格納したデータフレームまたはNumpy配列。
+        memory_budget (int): 全スレッドの作業用配列に使うメモリの上限（バイト）。
+        n_jobs (int | None): 並列に処理するスレッド数。Noneの場合はCPUコア数。
+
+    Returns:
+        pd.DataFrame: matrix_aの各行とmatrix_bの各行の間のJSダイバージェンスを格納したデータフレーム。
+    """
+    index = matrix_a.index if isinstance(matrix_a, pd.DataFrame) else None
+    columns = matrix_b.index if isinstance(matrix_b, pd.DataFrame) else None
+    p = np.asarray(matrix_a.values if isinstance(matrix_a, pd.DataFrame) else matrix_a, dtype=np.float64)
+    q = np.asarray(matrix_b.values if isinstance(matrix_b, pd.DataFrame) else matrix_b, dtype=np.float64)
+    n, m, d = len(p), len(q), p.shape[1]
+    n_jobs = n_jobs or os.cpu_count() or 1
+
+    entropy_p = _row_entropies(p)
+    entropy_q = _row_entropies(q)
+    js_divergence = np.empty((n, m), dtype=np.float64)
+
+    # 1タイルあたり (rows, cols, d) の配列を2つ使う. 全スレッドの合計がmemory_budgetに収まるようにする
+    tile_elements = max(d, memory_budget // (2 * 8 * n_jobs))
+    cols = min(m, max(1, tile_elements // d))
+    rows = min(n, max(1, tile_elements // (d * cols)))
+
+    def compute_tile(row, col):
+        js_divergence[row:row + rows, col:col + cols] = _js_tile(
+            p[row:row + rows], q[col:col + cols], entropy_p[row:row + rows], entropy_q[col:col + cols]
+        )
+
+    tiles = [(row, col) for row in range(0, n, rows) for col in range(0, m, cols)]
+    if n_jobs == 1 or len(tiles) == 1:
+        for tile in tiles:
+            compute_tile(*tile)
+    else:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            # 例外を呼び出し元に伝えるため結果を取り出す
+            list(executor.map(lambda tile: compute_tile(*tile), tiles))
+
+    return pd.DataFrame(js_divergence, index=index, columns=columns)
\ No newline at end of file
@@ -0,0 +1,152 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from ..threading_process import WorkerPool
+from .cosine_similarity import _normalize_rows
+from .js_divergence import _js_tile, _row_entropies
+
+
+def _create_shared(shape: tuple, dtype) -> tuple[shared_memory.SharedMemory, tuple]:
+    """共有メモリを確保し, 共有メモリと, ワーカーが参照するための (名前, 形, 型) を返す."""
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    return shm, (shm.name, tuple(shape), dtype.str)
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    """ワーカー側で共有メモリを開く. 削除は親プロセスがunlinkで行う."""
+    return shared_memory.SharedMemory(name=name)
+
+
+def _run_block(kernel, specs, *args):
+    """ワーカーで共有メモリ上の配列を開き, kernel(*配列, *args) を実行する."""
+    shms = [_attach(name) for name, _, _ in specs]
+    try:
+        # 配列のビューは呼び出しが終わると解放されるので, その後で共有メモリを閉じられる
+        kernel(*[np.ndarray(shape, dtype=dtype, buffer=shm.buf) for shm, (_, shape, dtype) in zip(shms, specs)], *args)
+    finally:
+        for shm in shms:
+            shm.close()
+
+
+def _cosine_block(a, b, out, start, stop):
+    np.matmul(a[start:stop], b.T, out=out[start:stop])
+
+
+def _js_block(p, q, entropy_p, entropy_q, out, start, stop, cols):
+    for col in range(0, len(q), cols):
+        out[start:stop, col:col + cols] = _js_tile(
+            p[start:stop], q[col:col + cols], entropy_p[start:stop], entropy_q[col:col + cols]
+        )
+
+
+class SharedMemoryExecutor:
+    """
+    cosine_similarityとJSダイバージェンスを, 共有メモリを使ってプロセス並列で計算する。
+
+    入力行列は呼び出しごとに1回だけ共有メモリへコピーし, 各ワーカーは行のブロックを計算して
+    共有メモリ上の出力バッファに直接書き込む。ワーカーに送るのは共有メモリの名前と行の範囲だけなので,
+    行列をpickleしてコピーすることはない。ワーカープロセスは使い回すため, 複数回の呼び出しではcloseまで開いておく。
+
+    Example:
+        with SharedMemoryExecutor(n_workers=32) as executor:
+            similarity = executor.cosine_similarity(matrix_a, matrix_b)
+            js_divergence = executor.js_divergence(prob_a, prob_b)
+    """
+
+    def __init__(self, n_workers: int | None = None, block_rows: int | None = None, memory_budget: int = 256 * 1024 ** 2):
+        """
+        Args:
+            n_workers (int | None): ワーカープロセスの数. Noneの場合はCPUコア数
+            block_rows (int | None): 1タスクで計算する行数. Noneの場合は行数をワーカー数の4倍に分ける
+            memory_budget (int): JSダイバージェンスで全ワーカーの作業用配列に使うメモリの上限（バイト）
+        """
+        self.pool = WorkerPool(max_workers=n_workers, backend="process")
+        self.n_workers = self.pool.max_workers
+        self.block_rows = block_rows
+        self.memory_budget = memory_budget
+
+    def _blocks(self, n: int) -> list[tuple[int, int]]:
+        block_rows = self.block_rows or max(1, -(-n // (4 * self.n_workers)))
+        return [(start, min(start + block_rows, n)) for start in range(0, n, block_rows)]
+
+    def _run(self, func, arrays: list[np.ndarray], shape: tuple, extra_args=()) -> np.ndarray:
+        """arraysを共有メモリに置き, 行のブロックごとにfuncを実行して (shape) の結果を返す."""
+        shms = []
+        try:
+            specs = []
+            for array in arrays:
+                shm, spec = _create_shared(array.shape, array.dtype)
+                shms.append(shm)
+                specs.append(spec)
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+            shm, spec = _create_shared(shape, np.float64)
+            shms.append(shm)
+            specs.append(spec)
+            futures = [
+                self.pool.submit(_run_block, func, specs, start, stop, *extra_args)
+                for start, stop in self._blocks(shape[0])
+            ]
+            # 例外を呼び出し元に伝えるため, すべての結果を取り出す
+            for future in futures:
+                future.result()
+            return np.ndarray(shape, dtype=np.float64, buffer=shm.buf).copy()
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+
+    def cosine_similarity(self, matrix_a, matrix_b, dtype=np.float64) -> pd.DataFrame:
+        """
+        cosine_similarityと同じ結果を行ブロックごとに並列に計算する。
+
+        Args:
+            matrix_a (pd.DataFrame or np.ndarray): (n, d) の行列
+            matrix_b (pd.DataFrame or np.ndarray): (m, d) の行列
+            dtype: 計算に使う型. np.float32にするとメモリと時間が半分程度になる
+        Returns:
+            pd.DataFrame: (n, m) のコサイン類似度
+        """
+        a = _normalize_rows(matrix_a, dtype)
+        b = _normalize_rows(matrix_b, dtype)
+        result = self._run(_cosine_block, [a, b], (len(a), len(b)))
+        return pd.DataFrame(
+            result,
+            index=matrix_a.index if isinstance(matrix_a, pd.DataFrame) else None,
+            columns=matrix_b.index if isinstance(matrix_b, pd.DataFrame) else None,
+        )
+
+    def js_divergence(self, matrix_a, matrix_b) -> pd.DataFrame:
+        """
+        get_js_divergence_at_onceと同じ値（丸め誤差の範囲）を行ブロックごとに並列に計算する。
+
+        Args:
+            matrix_a (pd.DataFrame or np.ndarray): 確率分布を各行に格納した (n, d) の行列
+            matrix_b (pd.DataFrame or np.ndarray): 確率分布を各行に格納した (m, d) の行列
+        Returns:
+            pd.DataFrame: (n, m) のJSダイバージェンス
+        """
+        p = np.ascontiguousarray(matrix_a.values if isinstance(matrix_a, pd.DataFrame) else matrix_a, dtype=np.float64)
+        q = np.ascontiguousarray(matrix_b.values if isinstance(matrix_b, pd.DataFrame) else matrix_b, dtype=np.float64)
+        # 各ワーカーは (ブロックの行数, cols, d) の配列を2つ使う
+        block_rows = self._blocks(len(p))[0][1] if len(p) else 1
+        cols = max(1, min(len(q), self.memory_budget // (2 * 8 * self.n_workers * block_rows * max(1, p.shape[1]))))
+        result = self._run(
+            _js_block, [p, q, _row_entropies(p), _row_entropies(q)], (len(p), len(q)), extra_args=(cols,)
+        )
+        return pd.DataFrame(
+            result,
+            index=matrix_a.index if isinstance(matrix_a, pd.DataFrame) else None,
+            columns=matrix_b.index if isinstance(matrix_b, pd.DataFrame) else None,
+        )
+
+    def close(self):
+        self.pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
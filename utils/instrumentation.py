@@ -0,0 +1,205 @@
+import bisect
+import json
+import logging
+import math
+import threading
+import time
+from typing import Callable, TextIO
+
+# EmbeddingとTwitterAPIのhooksに渡される関数は hooks(event, **fields) の形で呼ばれる.
+# event と fields:
+#   "request":         component, endpoint, latency(秒), items, bytes, status
+#   "retry":           component, endpoint, delay(秒), status
+#   "rate_limit_wait": component, endpoint, seconds
+#   "cache":           component, endpoint, hits, misses
+# hooksを指定しない場合, クライアントはNoneかどうかを確かめるだけで計測を行わない.
+
+# レイテンシのヒストグラムの境界(秒). 1msから約131秒まで2倍ずつ
+LATENCY_BUCKETS = tuple(0.001 * 2 ** i for i in range(18))
+
+
+class _Histogram:
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """q分位点をヒストグラムから求める. バケット内は線形に補間する."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - cumulative) / count)
+            cumulative += count
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max,
+            "buckets": {
+                (f"le_{bound:g}" if i < len(self.bounds) else "inf"): count
+                for i, (bound, count) in enumerate(zip(self.bounds + (math.inf,), self.counts))
+                if count
+            },
+        }
+
+
+class _EndpointMetrics:
+    def __init__(self):
+        self.latency = _Histogram()
+        self.requests = 0
+        self.errors = 0
+        self.items = 0
+        self.bytes = 0
+        self.retries = 0
+        self.retry_delay = 0.0
+        self.rate_limit_wait = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def to_dict(self) -> dict:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "items": self.items,
+            "bytes": self.bytes,
+            "items_per_request": self.items / self.requests if self.requests else 0.0,
+            "bytes_per_request": self.bytes / self.requests if self.requests else 0.0,
+            "retries": self.retries,
+            "retry_delay_seconds": self.retry_delay,
+            "rate_limit_wait_seconds": self.rate_limit_wait,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_rate": self.cache_hits / lookups if lookups else 0.0,
+            "latency": self.latency.to_dict(),
+        }
+
+
+class MetricsCollector:
+    """hooksとして渡し, エンドポイント（モデル）ごとにレイテンシのヒストグラムや件数を集計する.
+
+    スレッドセーフで, 複数のクライアントやワーカーから共有できる.
+
+    Example:
+        metrics = MetricsCollector()
+        embedding = Embedding(api_key, hooks=metrics)
+        twitter = TwitterAPI(bearer_token, username, hooks=metrics)
+        ...
+        metrics.to_json("metrics.json")
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def __call__(self, event: str, component: str = "", endpoint: str = "", **fields):
+        key = f"{component}:{endpoint}"
+        with self._lock:
+            metrics = self._metrics.get(key)
+            if metrics is None:
+                metrics = self._metrics[key] = _EndpointMetrics()
+            if event == "request":
+                metrics.requests += 1
+                metrics.latency.add(fields.get("latency", 0.0))
+                metrics.items += fields.get("items", 0)
+                metrics.bytes += fields.get("bytes", 0)
+                if fields.get("status") != 200:
+                    metrics.errors += 1
+            elif event == "retry":
+                metrics.retries += 1
+                metrics.retry_delay += fields.get("delay", 0.0)
+            elif event == "rate_limit_wait":
+                metrics.rate_limit_wait += fields.get("seconds", 0.0)
+            elif event == "cache":
+                metrics.cache_hits += fields.get("hits", 0)
+                metrics.cache_misses += fields.get("misses", 0)
+
+    def snapshot(self) -> dict[str, dict]:
+        """"component:endpoint" ごとの集計結果を返す."""
+        with self._lock:
+            return {key: metrics.to_dict() for key, metrics in self._metrics.items()}
+
+    def to_json(self, path: str | None = None) -> str:
+        """集計結果をJSON文字列にする. pathを指定した場合はファイルにも書き込む."""
+        text = json.dumps(self.snapshot(), indent=2, ensure_ascii=False)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text + "\n")
+        return text
+
+    def reset(self):
+        with self._lock:
+            self._metrics = {}
+
+
+class LoggingHook:
+    """イベントを1件ずつloggingに出力するhooks."""
+
+    def __init__(self, logger: logging.Logger | None = None, level: int = logging.DEBUG):
+        """
+        Args:
+            logger (logging.Logger | None): 出力先. Noneの場合は "research_code_utils.instrumentation"
+            level (int): 出力するログレベル
+        """
+        self.logger = logger or logging.getLogger("research_code_utils.instrumentation")
+        self.level = level
+
+    def __call__(self, event: str, **fields):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, "%s %s", event, " ".join(f"{k}={v}" for k, v in fields.items()))
+
+
+class JSONLinesHook:
+    """イベントを時刻付きでJSON Linesとして書き出すhooks. 後から集計し直す場合に使う."""
+
+    def __init__(self, file: str | TextIO):
+        """
+        Args:
+            file (str | TextIO): 追記するファイルのパス, または書き込み可能なファイルオブジェクト
+        """
+        self._owns_file = isinstance(file, str)
+        self._file = open(file, "a") if self._owns_file else file
+        self._lock = threading.Lock()
+
+    def __call__(self, event: str, **fields):
+        line = json.dumps({"time": time.time(), "event": event, **fields}, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        if self._owns_file:
+            self._file.close()
+
+
+def combine_hooks(*hooks: Callable | None) -> Callable | None:
+    """複数のhooksを1つにまとめる. Noneは無視し, すべてNoneの場合はNoneを返す."""
+    hooks = [hook for hook in hooks if hook is not None]
+    if not hooks:
+        return None
+    if len(hooks) == 1:
+        return hooks[0]
+
+    def combined(event: str, **fields):
+        for hook in hooks:
+            hook(event, **fields)
+
+    return combined
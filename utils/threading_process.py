@@ -1,17 +1,185 @@
+import atexit
+import concurrent.futures
+import itertools
+import os
+import threading
+from collections import deque
+from typing import Callable, Iterable, Iterator, Literal
+
+
+def _run_chunk(func, chunk):
+    """Apply func to every item of a chunk. Defined at module level so that process workers can unpickle it."""
+    return [func(item) for item in chunk]
+
+
+class WorkerPool:
+    """
+    A long-lived pool of thread or process workers.
+
+    Unlike creating an executor per call, the workers are started once and reused, so it can be shared by the
+    API clients (I/O-bound, thread backend) and the comparison kernels (CPU-bound, process backend).
+    Submissions block while max_pending tasks are already queued or running, which keeps memory bounded
+    when a producer is faster than the workers.
+
+    Example:
+        with WorkerPool(max_workers=8) as pool:
+            for result in pool.map(fetch, urls, ordered=False):
+                ...
+    """
+
+    def __init__(
+        self,
+        max_workers: int | None = None,
+        backend: Literal["thread", "process"] = "thread",
+        max_pending: int | None = None,
+    ):
+        """
+        Args:
+            max_workers (int | None): Number of workers. Defaults to the number of CPUs for the process backend,
+                and to min(32, CPUs + 4) for the thread backend as in ThreadPoolExecutor.
+            backend (str): "thread" or "process". Functions given to the process backend must be picklable.
+            max_pending (int | None): Maximum number of tasks submitted but not finished. Defaults to 2 * max_workers.
+        """
+        if backend not in ("thread", "process"):
+            raise ValueError(f"Unsupported backend: {backend}")
+        n_cpus = os.cpu_count() or 1
+        self.max_workers = max_workers or (min(32, n_cpus + 4) if backend == "thread" else n_cpus)
+        self.backend = backend
+        self.max_pending = max_pending or 2 * self.max_workers
+        if backend == "thread":
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        else:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._closed = False
+
+    def submit(self, func: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Schedule func(*args, **kwargs) and return its Future without waiting for the result.
+        Blocks while max_pending tasks are in flight.
+        """
+        if self._closed:
+            raise RuntimeError("Cannot submit to a pool that has been shut down")
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(func, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def submit_unbounded(self, func: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """
+        Schedule func(*args, **kwargs) without waiting for a free max_pending slot.
+
+        The task shares the workers with submit and map, but it is neither limited by nor counted toward
+        max_pending, so this never blocks. Use it where the caller must not stall, such as fire-and-forget
+        calls or code already running on a worker of this pool.
+        """
+        if self._closed:
+            raise RuntimeError("Cannot submit to a pool that has been shut down")
+        return self._executor.submit(func, *args, **kwargs)
+
+    def map(
+        self,
+        func: Callable,
+        iterable: Iterable,
+        ordered: bool = True,
+        chunksize: int = 1,
+    ) -> Iterator:
+        """
+        Apply func to every item of iterable in parallel.
+
+        The iterable is consumed lazily, and at most max_pending chunks are in flight at a time.
+
+        Args:
+            func (callable): Function applied to each item.
+            iterable (Iterable): Input items. May be a generator of unknown length.
+            ordered (bool): If True, results are yielded in input order. Otherwise in completion order.
+            chunksize (int): Number of items sent to a worker at once. Larger chunks reduce overhead for cheap funcs.
+
+        Yields:
+            The result of func for each item.
+        """
+        iterator = iter(iterable)
+        chunks = iter(lambda: list(itertools.islice(iterator, chunksize)), [])
+        pending = deque() if ordered else set()
+
+        def fill():
+            while len(pending) < self.max_pending:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                future = self.submit(_run_chunk, func, chunk)
+                if ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+
+        try:
+            fill()
+            while pending:
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    pending.difference_update(done)
+                for future in done:
+                    yield from future.result()
+                fill()
+        finally:
+            # Cancel whatever is still queued if the consumer stops early or a task raised
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = False):
+        """
+        Stop accepting new tasks and release the workers.
+
+        Args:
+            wait (bool): Wait for running tasks to finish.
+            cancel_futures (bool): Cancel tasks that have not started yet.
+        """
+        self._closed = True
+        self._executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> WorkerPool:
+    """Return the process-wide thread pool used by run_in_executor, creating it on first use."""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = WorkerPool(backend="thread")
+            atexit.register(_default_pool.shutdown)
+        return _default_pool
+
+
 def run_in_executor(func, *args, **kwargs):
     """
-    Run a function in a separate thread using ThreadPoolExecutor.
-    
+    Run a function in a separate thread of the shared WorkerPool.
+
+    This never blocks: the task bypasses the pool's max_pending limit, so calling it from inside another
+    task, or submitting many tasks before reading any result, cannot stall the caller. Tasks still share
+    the pool's fixed number of threads. A task that waits on the Future of another run_in_executor task
+    can therefore deadlock once every thread is waiting. Use a dedicated WorkerPool for such nested work.
+
     Args:
         func (callable): The function to run.
         *args: Positional arguments to pass to the function.
         **kwargs: Keyword arguments to pass to the function.
-    
+
     Returns:
         Future: A Future object representing the execution of the function.
     """
-    import concurrent.futures
-    
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future = executor.submit(func, *args, **kwargs)
-    return future
\ No newline at end of file
+    return get_default_pool().submit_unbounded(func, *args, **kwargs)